@@ -0,0 +1,567 @@
+"""
+asyncio counterpart of ``django_cbtools.sync_gateway`` and of the
+loading / saving functions of ``django_cbtools.models``.
+
+Requires Python 3.5+ and ``aiohttp`` (``pip install django-cbtools[async]``).
+"""
+import asyncio
+import json
+import logging
+import weakref
+from collections import OrderedDict, namedtuple
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from django_cbtools import cache, identity_map, loader
+from django_cbtools.sync_gateway import (SyncGateway, SyncGatewayException, SyncGatewayBulkError,
+                                         chunks, DEFAULT_BULK_CHUNK_SIZE, DEFAULT_ALL_DOCS_CHUNK_SIZE)
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ASYNC_LIMIT = 100
+DEFAULT_VIEWS_PORT = 8092
+
+# view parameters sent as JSON
+JSON_VIEW_PARAMS = ('key', 'keys', 'startkey', 'endkey')
+
+# same fields as ``couchbase.views.iterator.ViewRow``
+ViewRow = namedtuple('ViewRow', ['key', 'value', 'docid', 'doc'])
+
+_sessions = weakref.WeakKeyDictionary()
+_loaders = weakref.WeakKeyDictionary()
+
+
+def get_session():
+    """
+    Returns ``aiohttp.ClientSession`` of the running event loop.
+    The session (and its connection pool) is shared by all the coroutines of the loop.
+    """
+    if aiohttp is None:
+        raise ImproperlyConfigured('aiohttp is required for asyncio support, '
+                                   'install it with `pip install django-cbtools[async]`')
+
+    loop = asyncio.get_event_loop()
+    session = _sessions.get(loop)
+    if session is None or session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=getattr(settings, 'SYNC_GATEWAY_ASYNC_LIMIT', DEFAULT_ASYNC_LIMIT),
+            limit_per_host=getattr(settings, 'SYNC_GATEWAY_ASYNC_LIMIT_PER_HOST', 0),
+            force_close=not getattr(settings, 'SYNC_GATEWAY_KEEP_ALIVE', True),
+            ssl=False)
+        session = aiohttp.ClientSession(connector=connector,
+                                        timeout=get_timeout(),
+                                        cookie_jar=aiohttp.DummyCookieJar())
+        _sessions[loop] = session
+    return session
+
+
+async def close_session():
+    """
+    Closes the session of the running event loop, call it on the loop shutdown.
+    """
+    session = _sessions.pop(asyncio.get_event_loop(), None)
+    if session is not None:
+        await session.close()
+
+
+def get_timeout():
+    timeout = getattr(settings, 'SYNC_GATEWAY_TIMEOUT', None)
+    if isinstance(timeout, (tuple, list)):
+        return aiohttp.ClientTimeout(sock_connect=timeout[0], sock_read=timeout[1])
+    return aiohttp.ClientTimeout(total=timeout)
+
+
+def get_auth():
+    return aiohttp.BasicAuth(settings.SYNC_GATEWAY_USER,
+                             settings.SYNC_GATEWAY_PASSWORD)
+
+
+async def request(method, url, data=None, auth=None):
+    """
+    Returns tuple (status code, response body).
+    """
+    async with get_session().request(method, url, data=data, auth=auth) as response:
+        body = await response.read()
+        return response.status, body
+
+
+class CouchbaseViewException(Exception):
+    pass
+
+
+class AsyncSyncGateway(object):
+    @staticmethod
+    async def put_user(username, email=None, password=None, admin_channels=None, disabled=False):
+        url = '%s/%s/_user/%s' % (settings.SYNC_GATEWAY_ADMIN_URL,
+                                  settings.SYNC_GATEWAY_BUCKET,
+                                  username)
+
+        dict_payload = SyncGateway._user_payload(email, password, admin_channels, disabled)
+
+        status, body = await request('put', url, data=json.dumps(dict_payload))
+        if status not in [200, 201]:
+            raise SyncGatewayException("Can not create / update sg-user, response code: %d" % status)
+
+        return True
+
+    @staticmethod
+    async def get_user(username):
+        url = '%s/%s/_user/%s' % (settings.SYNC_GATEWAY_ADMIN_URL,
+                                  settings.SYNC_GATEWAY_BUCKET,
+                                  username)
+
+        status, body = await request('get', url)
+        if status not in [200, 201]:
+            raise SyncGatewayException("Can not get user (%s), response code: %d" % (username, status))
+
+        return json.loads(body.decode('utf-8'))
+
+    @staticmethod
+    async def get_users():
+        url = '%s/%s/_user/' % (settings.SYNC_GATEWAY_ADMIN_URL,
+                                settings.SYNC_GATEWAY_BUCKET)
+
+        status, body = await request('get', url)
+        if status not in [200, 201]:
+            raise SyncGatewayException("Can not get users, response code: %d" % status)
+
+        return json.loads(body.decode('utf-8'))
+
+    @staticmethod
+    async def change_username(old_username, new_username, password):
+        if old_username == new_username:
+            return False
+
+        json_payload = await AsyncSyncGateway.get_user(old_username)
+        await AsyncSyncGateway.put_user(username=new_username,
+                                        email=new_username,
+                                        password=password,
+                                        admin_channels=json_payload['admin_channels'],
+                                        disabled=False)
+        await AsyncSyncGateway.delete_user(old_username)
+        return True
+
+    @staticmethod
+    async def create_session(username, ttl=None):
+        """
+        Returns the session dictionary (``session_id``, ``expires``, ``cookie_name``).
+        """
+        url = '%s/%s/_session' % (settings.SYNC_GATEWAY_ADMIN_URL,
+                                  settings.SYNC_GATEWAY_BUCKET)
+
+        dict_payload = dict(name=username)
+
+        if ttl is not None:
+            dict_payload['ttl'] = ttl
+
+        status, body = await request('post', url, data=json.dumps(dict_payload))
+
+        if status != 200:
+            message = "Can not create session for sg-user (%s), response code: %d" % (username, status)
+            raise SyncGatewayException(message)
+        return json.loads(body.decode('utf-8'))
+
+    @staticmethod
+    async def delete_user(username):
+        url = '%s/%s/_user/%s' % (settings.SYNC_GATEWAY_ADMIN_URL,
+                                  settings.SYNC_GATEWAY_BUCKET,
+                                  username)
+
+        status, body = await request('delete', url)
+        if status not in [200, 201]:
+            raise SyncGatewayException("Can not delete user, response code: %d" % status)
+
+        return True
+
+    @staticmethod
+    async def append_channels(username, channels):
+        json_payload = await AsyncSyncGateway.get_user(username)
+        new_channels = set(json_payload['admin_channels'])
+        new_channels.update(channels)
+        return await AsyncSyncGateway.put_user(username=username, admin_channels=list(new_channels))
+
+    @staticmethod
+    async def remove_channels(username, channels):
+        json_payload = await AsyncSyncGateway.get_user(username)
+        new_channels = set(json_payload['admin_channels'])
+        new_channels.difference_update(channels)
+        return await AsyncSyncGateway.put_user(username=username, admin_channels=list(new_channels))
+
+    @staticmethod
+    async def save_json(uid, data_dict):
+        """
+        Saves dictinary `data_dict`, returns tuple (status code, response body).
+        """
+        url = '%s/%s/%s' % (settings.SYNC_GATEWAY_URL,
+                            settings.SYNC_GATEWAY_BUCKET,
+                            uid)
+
+        status, body = await request('put', url, data=json.dumps(data_dict), auth=get_auth())
+
+        if cache.get_cache() is not None:
+            if status in [200, 201]:
+                cache.saved(uid, json.loads(body.decode('utf-8'))['rev'], data_dict)
+            else:
+                cache.invalidate(uid)
+
+        return status, body
+
+    @staticmethod
+    async def save_document(document):
+        data_dict = SyncGateway._document_payload(document)
+
+        status, body = await AsyncSyncGateway.save_json(document.get_uid(), data_dict)
+
+        if status not in [200, 201]:
+            raise SyncGateway._save_error(document, status)
+
+        document.rev = json.loads(body.decode('utf-8'))['rev']
+
+    @staticmethod
+    async def bulk_docs(docs):
+        url = '%s/%s/_bulk_docs' % (settings.SYNC_GATEWAY_URL,
+                                    settings.SYNC_GATEWAY_BUCKET)
+
+        status, body = await request('post', url, data=json.dumps(dict(docs=docs)), auth=get_auth())
+
+        if status not in [200, 201]:
+            raise SyncGatewayException("Can not save documents in bulk, response code: %d" % status)
+
+        return json.loads(body.decode('utf-8'))
+
+    @staticmethod
+    async def bulk_save(documents, chunk_size=None):
+        """
+        See ``SyncGateway.bulk_save``, the chunks are sent concurrently.
+        """
+        documents = list(documents)
+        chunk_size = chunk_size or getattr(settings, 'SYNC_GATEWAY_BULK_CHUNK_SIZE', DEFAULT_BULK_CHUNK_SIZE)
+        parts = list(chunks(documents, chunk_size))
+
+        results = await asyncio.gather(*[AsyncSyncGateway.bulk_docs(SyncGateway._bulk_payload(part))
+                                         for part in parts], return_exceptions=True)
+
+        # revisions of the written chunks are applied even if other chunks failed
+        failures = [x for x in results if isinstance(x, Exception)]
+        if len(failures) == len(results):
+            raise failures[0]
+
+        errors = []
+        for part, result in zip(parts, results):
+            if isinstance(result, Exception):
+                errors.extend(SyncGateway._unsent_errors(part, result))
+            else:
+                SyncGateway._bulk_results(part, result, errors)
+
+        if errors:
+            raise SyncGatewayBulkError("Can not save %d of %d documents" % (len(errors), len(documents)), errors)
+
+    @staticmethod
+    async def delete_document(uid, rev):
+        url = '%s/%s/%s?rev=%s' % (settings.SYNC_GATEWAY_URL,
+                                   settings.SYNC_GATEWAY_BUCKET,
+                                   uid, rev)
+
+        status, body = await request('delete', url, auth=get_auth())
+        cache.invalidate(uid)
+
+        if status not in [200, 201]:
+            raise SyncGatewayException("Can not delete document %s, response code: %d" % (uid, status))
+
+    @staticmethod
+    async def all_docs(uids, really_all=False):
+        """
+        See ``SyncGateway.all_docs``, the chunks are loaded concurrently.
+        """
+        if not uids and not really_all:
+            return {"rows": []}
+
+        if not uids:
+            return await AsyncSyncGateway._all_docs(None)
+
+        uids = list(uids)
+        chunk_size = getattr(settings, 'SYNC_GATEWAY_ALL_DOCS_CHUNK_SIZE', DEFAULT_ALL_DOCS_CHUNK_SIZE)
+        if len(uids) <= chunk_size:
+            return await AsyncSyncGateway._all_docs(uids)
+
+        results = await asyncio.gather(*[AsyncSyncGateway._all_docs(part)
+                                         for part in chunks(uids, chunk_size)])
+
+        rows = []
+        for result in results:
+            rows.extend(result['rows'])
+
+        return dict(results[0], rows=rows)
+
+    @staticmethod
+    async def _all_docs(uids):
+        url = '%s/%s/_all_docs?include_docs=true' % (settings.SYNC_GATEWAY_URL,
+                                                     settings.SYNC_GATEWAY_BUCKET)
+
+        json_data = json.dumps(dict(keys=uids)) if uids else None
+        status, body = await request('post', url, data=json_data, auth=get_auth())
+
+        return json.loads(body.decode('utf-8'))
+
+
+async def load(class_name, uid):
+    d = await AsyncSyncGateway.all_docs([uid])
+    obj = class_name()
+    obj.from_sync_gateway_row(d['rows'][0])
+    return obj
+
+
+async def save(obj):
+    from django_cbtools.signals import cb_post_save
+
+    is_new_document = obj._before_save()
+
+    await AsyncSyncGateway.save_document(obj)
+    obj._take_snapshot()
+
+    cb_post_save.send(sender=obj.__class__, instance=obj, created=is_new_document)
+
+
+async def delete(obj):
+    from django_cbtools.signals import cb_pre_delete, cb_post_delete
+
+    cb_pre_delete.send(sender=obj.__class__, instance=obj)
+    obj.st_deleted = True
+    await save(obj)
+    cb_post_delete.send(sender=obj.__class__, instance=obj)
+
+
+async def load_objects(keys, class_name):
+    from django_cbtools.models import objects_from_rows
+
+    d = await AsyncSyncGateway.all_docs(keys)
+    return list(objects_from_rows(d['rows'], class_name))
+
+
+async def query_objects(view_name, query_key, class_name, query=None):
+    keys = await query_view(view_name, query_key, query=query)
+    return await load_objects(keys, class_name)
+
+
+def get_views_url():
+    """
+    Returns URL of the Couchbase views REST API, ``COUCHBASE_VIEWS_URL``
+    or port 8092 of the first of ``COUCHBASE_HOSTS``.
+    """
+    url = getattr(settings, 'COUCHBASE_VIEWS_URL', None)
+    if url:
+        return url.rstrip('/')
+
+    hosts = settings.COUCHBASE_HOSTS
+    host = hosts if isinstance(hosts, str) else hosts[0]
+    return 'http://%s:%d' % (host.split(':')[0], DEFAULT_VIEWS_PORT)
+
+
+def get_views_auth():
+    password = getattr(settings, 'COUCHBASE_PASSWORD', None)
+    if not password:
+        return None
+    return aiohttp.BasicAuth(settings.COUCHBASE_BUCKET, password)
+
+
+def encode_view_params(params):
+    """
+    Encodes ``couchbase.views.params.Query`` parameters for the query string.
+    """
+    encoded = {}
+    for name, value in params.items():
+        if value is None:
+            continue
+        if name in JSON_VIEW_PARAMS:
+            value = json.dumps(value)
+        elif name == 'stale':
+            if not isinstance(value, str):
+                value = 'ok' if value else 'false'
+        elif isinstance(value, bool):
+            value = 'true' if value else 'false'
+        encoded[name] = str(value)
+    return encoded
+
+
+async def view_rows(view_name, query=None, **params):
+    """
+    Queries the view with the views REST API and returns the list of ``ViewRow``.
+    ``params`` are ``couchbase.views.params.Query`` parameters (``key``,
+    ``startkey``, ``limit``, ...), or pass ``Query`` object as ``query``.
+    The rows are not reduced unless ``reduce=True`` is given in ``params``.
+    """
+    from django_cbtools.models import parse_view_name, get_stale, rows_query
+
+    design, view = parse_view_name(view_name)
+    url = '%s/%s/_design/%s/_view/%s' % (get_views_url(), settings.COUCHBASE_BUCKET, design, view)
+
+    if query is not None:
+        url += '?' + rows_query(query).encoded
+        query_params = None
+    else:
+        params.setdefault('stale', get_stale())
+        params.setdefault('reduce', False)
+        query_params = encode_view_params(params)
+
+    # long lists of keys don't fit into the query string
+    data = None
+    if query_params and 'keys' in query_params:
+        data = json.dumps(dict(keys=params['keys']))
+        del query_params['keys']
+
+    async with get_session().request('post' if data else 'get', url, params=query_params, data=data,
+                                     auth=get_views_auth()) as response:
+        body = await response.read()
+        status = response.status
+
+    if status != 200:
+        raise CouchbaseViewException("Can not query view %s, response code: %d, %s" %
+                                     (view_name, status, body.decode('utf-8', 'replace')))
+
+    result = json.loads(body.decode('utf-8'))
+    for error in result.get('errors') or []:
+        logger.warning('Error querying view %s: %s', view_name, error)
+
+    return [ViewRow(x.get('key'), x.get('value'), x.get('id'), None) for x in result['rows']]
+
+
+async def query_view(view_name, query_key, query=None):
+    """
+    Coroutine version of ``django_cbtools.models.query_view``.
+    """
+    if query is not None:
+        rows = await view_rows(view_name, query=query)
+    else:
+        rows = await view_rows(view_name, key=query_key)
+    return [x.docid for x in rows]
+
+
+class AsyncView(object):
+    """
+    Rows of the view, ``params`` are the same as of ``view_rows``::
+
+        async for row in AsyncView('by_channel', key=['channel_name', 'article']):
+            print(row.docid)
+
+        rows = await AsyncView('by_type', key='article', limit=10)
+
+    The view is queried once, on the first iteration.
+    """
+
+    def __init__(self, view_name, query=None, **params):
+        self.view_name = view_name
+        self.query = query
+        self.params = params
+        self._rows = None
+
+    async def rows(self):
+        if self._rows is None:
+            self._rows = await view_rows(self.view_name, query=self.query, **self.params)
+        return self._rows
+
+    def __await__(self):
+        return self.rows().__await__()
+
+    def __aiter__(self):
+        return _AsyncViewIterator(self)
+
+
+class _AsyncViewIterator(object):
+    def __init__(self, view):
+        self.view = view
+        self.rows = None
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.rows is None:
+            self.rows = iter(await self.view.rows())
+        try:
+            return next(self.rows)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class AsyncLoader(object):
+    """
+    Collects ``load`` calls made during one iteration of the event loop
+    and loads all the documents with one ``_all_docs`` request::
+
+        customers = await asyncio.gather(*[load_later(x.customer_uid, CBCustomer) for x in orders])
+    """
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.pending = OrderedDict()
+        # the loop keeps weak references to tasks only
+        self.tasks = set()
+
+    def load(self, uid, model_class):
+        """
+        Returns future of the document, its result is ``None`` if the document is not found.
+        """
+        key = (model_class, uid)
+        future = self.pending.get(key)
+        if future is not None:
+            return future
+
+        future = self.loop.create_future()
+
+        obj = identity_map.get_mapped(model_class, uid) if uid else None
+        if obj is not None or not uid:
+            future.set_result(obj)
+            return future
+
+        if not self.pending:
+            self.loop.call_soon(self._start_dispatch)
+        self.pending[key] = future
+        return future
+
+    def _start_dispatch(self):
+        task = self.loop.create_task(self.dispatch())
+        self.tasks.add(task)
+        task.add_done_callback(self._dispatched)
+
+    def _dispatched(self, task):
+        self.tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error('Loading of documents failed', exc_info=task.exception())
+
+    async def dispatch(self):
+        pending, self.pending = self.pending, OrderedDict()
+        if not pending:
+            return
+
+        uids = list(OrderedDict((uid, None) for model_class, uid in pending))
+        try:
+            d = await AsyncSyncGateway.all_docs(uids)
+            loader.resolve(pending, dict(zip(uids, d['rows'])))
+        except Exception as e:
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(e)
+
+
+def get_loader():
+    """
+    Returns ``AsyncLoader`` of the running event loop.
+    """
+    loop = asyncio.get_event_loop()
+    async_loader = _loaders.get(loop)
+    if async_loader is None:
+        async_loader = _loaders[loop] = AsyncLoader(loop)
+    return async_loader
+
+
+def load_later(uid, model_class):
+    """
+    Batched version of ``try_else_return_none_obj``: ``obj = await load_later(uid, Model)``.
+    """
+    return get_loader().load(uid, model_class)
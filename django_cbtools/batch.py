@@ -0,0 +1,133 @@
+"""
+Unit of work for saving documents. Inside ``cb_batch()`` block ``save()``
+and ``delete()`` only record the documents, they are written at the end
+of the block with a few ``_bulk_docs`` requests::
+
+    with cb_batch():
+        for article in articles:
+            article.views += 1
+            article.save()
+
+A document saved several times in the block is written once.
+"""
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from django_cbtools.signals import cb_post_delete
+
+_local = threading.local()
+
+
+class WriteBatch(object):
+    def __init__(self, chunk_size=None):
+        self.chunk_size = chunk_size
+        # id(document) -> [document, is new, is deleted]
+        self.entries = OrderedDict()
+        self.by_uid = {}
+
+    def add(self, document, deleted=False):
+        key = id(document)
+        entry = self.entries.get(key)
+
+        if entry is None:
+            entry = [document, document.is_new(), False]
+
+            # another instance of the same document replaces the recorded one
+            other = self.by_uid.get(document.uid) if document.uid else None
+            if other is not None and other != key:
+                replaced = self.entries.pop(other)
+                entry[1] = entry[1] or replaced[1]
+                entry[2] = replaced[2]
+
+            self.entries[key] = entry
+
+        # new documents get their uid at once, like with ``save()`` outside of the block
+        self.by_uid[document.get_uid()] = key
+        entry[2] = entry[2] or deleted
+
+    def __len__(self):
+        return len(self.entries)
+
+    def flush(self):
+        """
+        Writes the recorded documents, then the ones recorded by the signal
+        handlers meanwhile. Raises ``SyncGatewayBulkError`` with the documents
+        which failed in all the rounds, the others are saved.
+        """
+        from django_cbtools.sync_gateway import SyncGatewayBulkError
+
+        errors = []
+        while self.entries:
+            try:
+                self._write()
+            except SyncGatewayBulkError as e:
+                errors.extend(e.errors)
+        if errors:
+            raise SyncGatewayBulkError("Can not write %d documents" % len(errors), errors)
+
+    def _write(self):
+        from django_cbtools.models import CouchbaseModel
+        from django_cbtools.sync_gateway import SyncGatewayBulkError
+
+        entries = list(self.entries.values())
+        self.entries = OrderedDict()
+        self.by_uid = {}
+        if not entries:
+            return
+
+        documents = [x[0] for x in entries]
+        for document in documents:
+            document._before_save()
+
+        try:
+            CouchbaseModel._bulk_write(documents, [x[1] for x in entries], self.chunk_size)
+        except SyncGatewayBulkError as e:
+            failed = set(id(x['document']) for x in e.errors)
+            self._send_post_delete([x for x in entries if id(x[0]) not in failed])
+            raise
+
+        self._send_post_delete(entries)
+
+    @staticmethod
+    def _send_post_delete(entries):
+        for document, is_new, deleted in entries:
+            if deleted:
+                cb_post_delete.send(sender=document.__class__, instance=document)
+
+    def discard(self):
+        self.entries = OrderedDict()
+        self.by_uid = {}
+
+
+def get_batch():
+    """
+    Returns the active ``WriteBatch`` of the current thread or ``None``.
+    """
+    return getattr(_local, 'batch', None)
+
+
+@contextmanager
+def cb_batch(chunk_size=None):
+    """
+    Records ``save()`` and ``delete()`` calls and writes the documents with
+    ``bulk_save`` at the end of the block, signals are sent as usual.
+    Nothing is written if the block raises an exception. Nested blocks
+    are written by the outer one.
+    """
+    current = get_batch()
+    if current is not None:
+        yield current
+        return
+
+    current = _local.batch = WriteBatch(chunk_size)
+    try:
+        try:
+            yield current
+        except Exception:
+            current.discard()
+            raise
+        # documents saved by the signal handlers go to the same batch
+        current.flush()
+    finally:
+        _local.batch = None
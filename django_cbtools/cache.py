@@ -0,0 +1,388 @@
+"""
+Read-through cache of Sync-Gateway rows used by ``SyncGateway.all_docs``.
+
+Only documents of ``doc_type`` listed in ``CBTOOLS_CACHE_DOC_TYPES`` are cached.
+Rows are kept JSON encoded, every hit returns a new copy, so the cached
+documents can't be changed through the loaded objects.
+
+There are two tiers: LRU in the process memory and, with ``CBTOOLS_SHARED_CACHE``,
+a Django cache shared by all the processes (memcached, redis, ...).
+"""
+import time
+from collections import OrderedDict
+from threading import Lock
+
+from django.conf import settings
+from django.core.cache import caches
+from django.dispatch import receiver
+
+from django_cbtools import serialization
+from django_cbtools.signals import cb_changes
+
+DEFAULT_CACHE_SIZE = 1000
+DEFAULT_CACHE_TTL = 300
+DEFAULT_SHARED_CACHE_TTL = 300
+
+_cache = None
+_cache_config = None
+
+
+def rev_generation(rev):
+    """
+    ``3-a1b2c3`` -> ``3``.
+    """
+    try:
+        return int(rev.split('-', 1)[0])
+    except (AttributeError, ValueError):
+        return 0
+
+
+def cacheable_rows(rows, doc_types):
+    """
+    Yields ``(uid, rev, encoded row)`` for rows of ``doc_types``,
+    rows with errors are skipped.
+    """
+    for row in rows:
+        doc = row.get('doc')
+        if 'error' in row or not doc or doc.get('doc_type') not in doc_types:
+            continue
+        yield row['id'], row['value']['rev'], serialization.dumps(row)
+
+
+class DocumentCache(object):
+    """
+    LRU cache of ``size`` rows, every row expires ``ttl`` seconds
+    after it was loaded (``None`` means never).
+
+    Entries are ``(expires, generation, data)``. Misses returned by
+    ``get_many`` are counted as being loaded until ``release``. A document
+    saved while it's being loaded leaves a tombstone with the generation
+    of the new revision, so the older revision loaded concurrently is not
+    cached. Tombstones are not kept in the LRU and are dropped when
+    the loads are over.
+    """
+
+    def __init__(self, size=DEFAULT_CACHE_SIZE, ttl=DEFAULT_CACHE_TTL, doc_types=()):
+        self.size = size
+        self.ttl = ttl
+        self.doc_types = frozenset(doc_types)
+        self.entries = OrderedDict()
+        # uid -> number of loads in flight
+        self.loading = {}
+        # uid -> generation saved during the loads
+        self.tombstones = {}
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, uids):
+        """
+        Returns dictionary of cached rows for ``uids``.
+        """
+        now = time.time()
+        found = {}
+
+        with self.lock:
+            for uid in uids:
+                entry = self.entries.get(uid)
+                if entry is not None and entry[0] is not None and entry[0] < now:
+                    del self.entries[uid]
+                    entry = None
+                if entry is None:
+                    self.misses += 1
+                    self.loading[uid] = self.loading.get(uid, 0) + 1
+                    continue
+                # python 2 OrderedDict has no move_to_end
+                del self.entries[uid]
+                self.entries[uid] = entry
+                found[uid] = entry[2]
+                self.hits += 1
+
+        return {uid: serialization.loads(data) for uid, data in found.items()}
+
+    def set_many(self, rows):
+        """
+        Puts the loaded ``rows`` to the cache, rows of other
+        document types and rows with errors are skipped.
+        """
+        entries = [(uid, rev_generation(rev), data) for uid, rev, data in cacheable_rows(rows, self.doc_types)]
+
+        if not entries:
+            return
+
+        expires = time.time() + self.ttl if self.ttl is not None else None
+
+        with self.lock:
+            for uid, generation, data in entries:
+                if self.tombstones.get(uid, 0) > generation:
+                    continue
+                current = self.entries.pop(uid, None)
+                if current is not None and current[1] > generation:
+                    self.entries[uid] = current
+                    continue
+                self.entries[uid] = (expires, generation, data)
+
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def release(self, uids):
+        """
+        The loads of ``uids`` (misses of ``get_many``) are over.
+        """
+        with self.lock:
+            for uid in uids:
+                count = self.loading.get(uid, 0) - 1
+                if count > 0:
+                    self.loading[uid] = count
+                else:
+                    self.loading.pop(uid, None)
+                    self.tombstones.pop(uid, None)
+
+    def invalidate(self, uid, rev=None):
+        """
+        Removes the document. With ``rev`` of the new revision the older
+        revisions being loaded at the moment are not cached.
+        """
+        with self.lock:
+            self.entries.pop(uid, None)
+            if rev is not None and uid in self.loading:
+                self.tombstones[uid] = max(rev_generation(rev), self.tombstones.get(uid, 0))
+
+    def invalidate_many(self, revs):
+        for uid, rev in revs:
+            self.invalidate(uid, rev)
+
+    def saved(self, row):
+        self.invalidate(row['id'], row['value']['rev'])
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.tombstones.clear()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        with self.lock:
+            return dict(size=len(self.entries), hits=self.hits, misses=self.misses)
+
+
+class SharedDocumentCache(object):
+    """
+    Rows stored in Django cache ``alias`` for ``ttl`` seconds, keyed by
+    uid and tagged with the revision: values are ``(rev, encoded row)``.
+
+    A row never replaces a newer revision, so an old revision read by one
+    process doesn't overwrite the one written through by another. Saved
+    documents leave ``(rev, None)`` to keep the older revisions out.
+
+    The revisions are compared with one ``get_many`` and the rows are
+    written with one ``set_many``. A newer revision stored by another
+    process between the two calls can be replaced, it's corrected by the
+    next save or ``cb_changes`` of the document, or in ``ttl`` seconds.
+    """
+
+    def __init__(self, alias, ttl=DEFAULT_SHARED_CACHE_TTL, doc_types=()):
+        self.alias = alias
+        self.ttl = ttl
+        self.doc_types = frozenset(doc_types)
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def backend(self):
+        return caches[self.alias]
+
+    def make_key(self, uid):
+        return 'cbtools:%s:%s' % (settings.SYNC_GATEWAY_BUCKET, uid)
+
+    def get_many(self, uids):
+        keys = dict((self.make_key(uid), uid) for uid in uids)
+        values = self.backend.get_many(list(keys))
+
+        values = dict((key, data) for key, (rev, data) in values.items() if data is not None)
+
+        with self.lock:
+            self.hits += len(values)
+            self.misses += len(keys) - len(values)
+
+        return dict((keys[key], serialization.loads(data)) for key, data in values.items())
+
+    def set_many(self, rows):
+        values = dict((self.make_key(uid), (rev, data)) for uid, rev, data in cacheable_rows(rows, self.doc_types))
+        self._store(values)
+
+    def _store(self, values):
+        """
+        Puts ``{key: (rev, data)}`` unless the cached revisions are newer.
+        """
+        if not values:
+            return
+
+        backend = self.backend
+        current = backend.get_many(list(values))
+
+        values = dict((key, value) for key, value in values.items()
+                      if key not in current or rev_generation(current[key][0]) <= rev_generation(value[0]))
+        if values:
+            backend.set_many(values, self.ttl)
+
+    def release(self, uids):
+        pass
+
+    def invalidate_many(self, revs):
+        keys = [self.make_key(uid) for uid, rev in revs if rev is None]
+        if keys:
+            self.backend.delete_many(keys)
+        self._store(dict((self.make_key(uid), (rev, None)) for uid, rev in revs if rev is not None))
+
+    def saved(self, row):
+        # write through, other processes get the new revision at once
+        self.set_many([row])
+
+    def clear(self):
+        # the backend is shared with other processes and applications,
+        # only the counters are cleared
+        with self.lock:
+            self.hits = self.misses = 0
+
+    def stats(self):
+        with self.lock:
+            return dict(shared_hits=self.hits, shared_misses=self.misses)
+
+
+class TieredDocumentCache(object):
+    """
+    Looks for rows in the ``tiers`` one by one, rows found in a slower
+    tier are put to the faster ones.
+    """
+
+    def __init__(self, tiers, doc_types):
+        self.tiers = tiers
+        self.doc_types = frozenset(doc_types)
+
+    def get_many(self, uids):
+        """
+        Returns dictionary of cached rows for ``uids``, ``release`` must
+        be called for the missing ones when they are loaded.
+        """
+        found = {}
+        missing = list(uids)
+
+        for i, tier in enumerate(self.tiers):
+            if not missing:
+                break
+            rows = tier.get_many(missing)
+            if not rows:
+                continue
+            for faster in self.tiers[:i]:
+                faster.set_many(rows.values())
+                faster.release([uid for uid in missing if uid in rows])
+            found.update(rows)
+            missing = [uid for uid in missing if uid not in rows]
+
+        return found
+
+    def set_many(self, rows):
+        for tier in self.tiers:
+            tier.set_many(rows)
+
+    def release(self, uids):
+        """
+        The loads of ``uids`` missed by ``get_many`` are over (successfully or not).
+        """
+        for tier in self.tiers:
+            tier.release(uids)
+
+    def saved(self, uid, rev, data_dict):
+        """
+        The document ``uid`` was saved with ``data_dict`` and got ``rev``.
+        """
+        row = dict(id=uid, value=dict(rev=rev), doc=dict(data_dict, _id=uid, _rev=rev))
+        for tier in self.tiers:
+            tier.saved(row)
+
+    def invalidate(self, uid, rev=None):
+        self.invalidate_many([(uid, rev)])
+
+    def invalidate_many(self, revs):
+        """
+        ``revs`` is a list of ``(uid, new rev or None)``.
+        """
+        for tier in self.tiers:
+            tier.invalidate_many(revs)
+
+    def clear(self):
+        for tier in self.tiers:
+            tier.clear()
+
+    def stats(self):
+        d = dict(size=0, hits=0, misses=0)
+        for tier in self.tiers:
+            d.update(tier.stats())
+        return d
+
+
+def get_cache():
+    """
+    Returns ``TieredDocumentCache`` configured by ``CBTOOLS_CACHE_*`` and
+    ``CBTOOLS_SHARED_CACHE*`` settings, ``None`` if ``CBTOOLS_CACHE_DOC_TYPES`` is empty.
+    """
+    global _cache, _cache_config
+
+    doc_types = getattr(settings, 'CBTOOLS_CACHE_DOC_TYPES', None)
+    if not doc_types:
+        return None
+
+    config = (frozenset(doc_types),
+              getattr(settings, 'CBTOOLS_CACHE_SIZE', DEFAULT_CACHE_SIZE),
+              getattr(settings, 'CBTOOLS_CACHE_TTL', DEFAULT_CACHE_TTL),
+              getattr(settings, 'CBTOOLS_SHARED_CACHE', None),
+              getattr(settings, 'CBTOOLS_SHARED_CACHE_TTL', DEFAULT_SHARED_CACHE_TTL))
+
+    if _cache is None or _cache_config != config:
+        doc_types, size, ttl, alias, shared_ttl = config
+        tiers = []
+        if size:
+            tiers.append(DocumentCache(size, ttl, doc_types))
+        if alias:
+            tiers.append(SharedDocumentCache(alias, shared_ttl, doc_types))
+        _cache = TieredDocumentCache(tiers, doc_types)
+        _cache_config = config
+
+    return _cache
+
+
+def saved(uid, rev, data_dict):
+    cache = get_cache()
+    if cache is not None:
+        cache.saved(uid, rev, data_dict)
+
+
+def invalidate(uid, rev=None):
+    cache = get_cache()
+    if cache is not None:
+        cache.invalidate(uid, rev)
+
+
+def invalidate_many(revs):
+    cache = get_cache()
+    if cache is not None and revs:
+        cache.invalidate_many(revs)
+
+
+@receiver(cb_changes)
+def invalidate_changed(sender, doc_type, changes, **kwargs):
+    """
+    Removes documents changed by other processes, it works in
+    ``cb_changes_worker`` process (mostly for the shared cache).
+    """
+    cache = get_cache()
+    if cache is None or (doc_type is not None and doc_type not in cache.doc_types):
+        return
+
+    revs = []
+    for change in changes:
+        rev = change['changes'][0]['rev'] if change.get('changes') else None
+        revs.append((change['id'], rev))
+    cache.invalidate_many(revs)
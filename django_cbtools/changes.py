@@ -0,0 +1,118 @@
+import logging
+import time
+from collections import OrderedDict
+
+from django_cbtools.checkpoint import FileCheckpoint
+from django_cbtools.models import DOC_TYPE_FIELD_NAME
+from django_cbtools.signals import cb_changes
+from django_cbtools.sync_gateway import SyncGateway, SyncGatewayException
+
+from requests import RequestException
+
+logger = logging.getLogger(__name__)
+
+
+class ChangesConsumer(object):
+    """
+    Reads Sync-Gateway ``_changes`` feed and sends ``cb_changes`` signal
+    once per ``doc_type`` for every batch of changes::
+
+        def on_articles(sender, doc_type, changes, **kwargs):
+            for change in changes:
+                cache.delete(change['id'])
+
+        cb_changes.connect(on_articles, sender='article')
+
+    The last processed sequence is saved in ``checkpoint`` after the signal
+    handlers are done, so a restarted consumer continues from there and every
+    change is delivered at least once.
+    """
+
+    def __init__(self, name='default', feed='longpoll', batch_size=100, include_docs=True,
+                 timeout=60000, checkpoint=None, retry_delay=5):
+        if feed not in ('longpoll', 'continuous'):
+            raise ValueError('feed must be longpoll or continuous')
+
+        self.name = name
+        self.feed = feed
+        self.batch_size = batch_size
+        self.include_docs = include_docs
+        self.timeout = timeout
+        self.checkpoint = checkpoint or FileCheckpoint.for_name('changes_%s' % name)
+        self.retry_delay = retry_delay
+        self.since = self.checkpoint.load()
+
+    def run(self, once=False):
+        """
+        Processes changes until interrupted. With ``once`` it processes
+        changes available right now and returns.
+        """
+        while True:
+            try:
+                if self.feed == 'continuous' and not once:
+                    self.run_continuous()
+                else:
+                    processed = self.run_batch(feed='normal' if once else 'longpoll')
+                    if once and not processed:
+                        return
+            except (SyncGatewayException, RequestException) as e:
+                if once:
+                    raise
+                logger.warning('changes feed error, will retry in %s seconds: %s', self.retry_delay, e)
+                time.sleep(self.retry_delay)
+
+    def run_batch(self, feed='longpoll'):
+        """
+        Processes one batch, returns number of changes.
+        """
+        d = SyncGateway.changes(since=self.since, feed=feed, limit=self.batch_size,
+                                include_docs=self.include_docs, timeout=self.timeout)
+        results = d.get('results', [])
+        self.dispatch(results)
+        self.commit(d.get('last_seq', self.since))
+        return len(results)
+
+    def run_continuous(self):
+        batch = []
+        started = None
+
+        for change in SyncGateway.iter_changes(since=self.since, include_docs=self.include_docs,
+                                               heartbeat=min(self.timeout, 30000)):
+            if change is not None:
+                if 'last_seq' in change:
+                    # the feed was closed by the server
+                    break
+                if not batch:
+                    started = time.time()
+                batch.append(change)
+
+            if batch and (len(batch) >= self.batch_size or time.time() - started >= self.timeout / 1000.0):
+                self.dispatch(batch)
+                self.commit(batch[-1]['seq'])
+                batch = []
+
+        if batch:
+            self.dispatch(batch)
+            self.commit(batch[-1]['seq'])
+
+    def dispatch(self, changes):
+        """
+        Sends ``cb_changes`` for every ``doc_type`` in ``changes``.
+        Changes of deleted documents and documents without ``doc_type``
+        are sent with ``doc_type`` ``None``.
+        """
+        by_doc_type = OrderedDict()
+        for change in changes:
+            # internal documents like ``_user/<name>``
+            if change.get('id', '').startswith('_'):
+                continue
+            doc_type = (change.get('doc') or {}).get(DOC_TYPE_FIELD_NAME)
+            by_doc_type.setdefault(doc_type, []).append(change)
+
+        for doc_type, doc_type_changes in by_doc_type.items():
+            cb_changes.send(sender=doc_type, doc_type=doc_type, changes=doc_type_changes)
+
+    def commit(self, since):
+        if since is not None and since != self.since:
+            self.since = since
+            self.checkpoint.save(since)
@@ -0,0 +1,44 @@
+import json
+import os
+import tempfile
+
+from django.conf import settings
+
+# atomic rename over the existing file (``os.rename`` does it on POSIX in Python 2)
+replace = getattr(os, 'replace', os.rename)
+
+
+class FileCheckpoint(object):
+    """
+    Progress of a long running job stored in a local JSON file,
+    so the job can continue after it was interrupted.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    @classmethod
+    def for_name(cls, name):
+        """
+        Checkpoint in ``CBTOOLS_CHECKPOINT_DIR`` (the temporary directory by default).
+        """
+        directory = getattr(settings, 'CBTOOLS_CHECKPOINT_DIR', None) or tempfile.gettempdir()
+        return cls(os.path.join(directory, 'django_cbtools_%s_%s.json' % (name, settings.SYNC_GATEWAY_BUCKET)))
+
+    def load(self, default=None):
+        try:
+            with open(self.path) as f:
+                return json.load(f)['value']
+        except (IOError, OSError, ValueError, KeyError):
+            return default
+
+    def save(self, value):
+        # write and rename, so a crash never leaves a broken file
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(dict(value=value), f)
+        replace(tmp_path, self.path)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
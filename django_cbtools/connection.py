@@ -1,17 +1,170 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
 from couchbase import Couchbase
 # from couchbase.bucket import Bucket
 from couchbase.connection import LOCKMODE_WAIT
+from couchbase.exceptions import CouchbaseError
 
 from django.conf import settings
 
+DEFAULT_POOL_SIZE = 10
+DEFAULT_POOL_TIMEOUT = 30
+
+# seconds between health checks of a connection
+HEALTH_CHECK_INTERVAL = 60
+HEALTH_CHECK_KEY = '_cbtools_health_check'
+
+
+class CouchbasePoolTimeout(Exception):
+    pass
+
+
+def connect():
+    return Couchbase.connect(bucket=settings.COUCHBASE_BUCKET,
+                             host=settings.COUCHBASE_HOSTS,
+                             password=settings.COUCHBASE_PASSWORD,
+                             lockmode=LOCKMODE_WAIT)
+
+
+def is_healthy(conn):
+    try:
+        conn.get(HEALTH_CHECK_KEY, quiet=True)
+    except CouchbaseError:
+        return False
+    return True
+
+
+class ConnectionPool(object):
+    """
+    Pool of bucket connections. Every operation checks out a connection
+    with ``connection()`` block and returns it at the end of the block, so
+    threads don't wait for each other on the lock of one shared connection.
+    Connections are created on demand, at most ``size`` of them; a thread
+    waits ``timeout`` seconds for a connection released by another thread,
+    then ``CouchbasePoolTimeout`` is raised.
+
+    Connections are checked before reuse when they were not used for
+    ``HEALTH_CHECK_INTERVAL`` seconds, broken ones are replaced.
+    """
+
+    def __init__(self, size=DEFAULT_POOL_SIZE, timeout=DEFAULT_POOL_TIMEOUT, factory=connect,
+                 check=is_healthy):
+        self.size = size
+        self.timeout = timeout
+        self.factory = factory
+        self.check = check
+        self.pid = os.getpid()
+        self.created = 0
+        # (connection, time it was released), the last released is used first
+        self.idle = []
+        self._cond = threading.Condition(threading.Lock())
+        self._shared = None
+
+    @contextmanager
+    def connection(self):
+        """
+        Checks out a connection for the block::
+
+            with pool.connection() as conn:
+                rows = list(View(conn, design, view))
+        """
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def shared(self):
+        """
+        Returns one connection (outside of the pool) shared by all the threads.
+        """
+        with self._cond:
+            if self._shared is None:
+                self._shared = self.factory()
+            return self._shared
+
+    def acquire(self):
+        deadline = time.time() + self.timeout
+        with self._cond:
+            while not self.idle and self.created >= self.size:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise CouchbasePoolTimeout("No free Couchbase connection in %s seconds, pool size %d" %
+                                               (self.timeout, self.size))
+                self._cond.wait(remaining)
+
+            if self.idle:
+                conn, released = self.idle.pop()
+            else:
+                conn, released = None, None
+                self.created += 1
+
+        if conn is not None and (time.time() - released <= HEALTH_CHECK_INTERVAL or self.check(conn)):
+            return conn
+
+        try:
+            return self.factory()
+        except Exception:
+            self.discard(None)
+            raise
+
+    def release(self, conn):
+        if os.getpid() != self.pid:
+            return
+        with self._cond:
+            self.idle.append((conn, time.time()))
+            self._cond.notify()
+
+    def discard(self, conn):
+        """
+        Forgets a broken connection, so another one can be created.
+        """
+        with self._cond:
+            self.created -= 1
+            self._cond.notify()
+
+    def stats(self):
+        with self._cond:
+            return dict(size=self.size, connections=self.created, idle=len(self.idle))
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """
+    Returns the connection pool of the current process, a new pool
+    is created after ``fork()``.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool.pid != os.getpid():
+            _pool = ConnectionPool(size=getattr(settings, 'COUCHBASE_POOL_SIZE', DEFAULT_POOL_SIZE),
+                                   timeout=getattr(settings, 'COUCHBASE_POOL_TIMEOUT', DEFAULT_POOL_TIMEOUT))
+        return _pool
+
+
+def pooled_connection():
+    """
+    Checks out a connection of the pool for the block, use it for every
+    operation (a view iterated to the end, ``get_multi`` call)::
+
+        with pooled_connection() as conn:
+            results = conn.get_multi(keys, quiet=True)
+    """
+    return get_pool().connection()
+
 
 def connection():
-    if not hasattr(connection, 'singleton'):
-        connection.singleton = Couchbase.connect(bucket=settings.COUCHBASE_BUCKET,
-                                                 host=settings.COUCHBASE_HOSTS,
-                                                 password=settings.COUCHBASE_PASSWORD,
-                                                 lockmode=LOCKMODE_WAIT)
-    return connection.singleton
+    """
+    Returns the bucket connection shared by all the threads of the process,
+    use ``pooled_connection()`` instead.
+    """
+    return get_pool().shared()
 
 
 # using of Bucket lead to bugs ???
@@ -0,0 +1,90 @@
+"""
+Request scoped identity map: inside ``identity_map()`` block every document
+is loaded once and every load of the same ``uid`` returns the same instance::
+
+    with identity_map():
+        a = CBArticle('atl_0a1cf319ae4e8b3d')
+        b = CBArticle('atl_0a1cf319ae4e8b3d')  # no request to Sync-Gateway
+        assert a is b
+
+``IdentityMapMiddleware`` opens the block for every request.
+"""
+import threading
+from contextlib import contextmanager
+
+from django.utils.deprecation import MiddlewareMixin
+
+_local = threading.local()
+
+
+class IdentityMap(object):
+    def __init__(self):
+        self.objects = {}
+
+    def get(self, model_class, uid):
+        return self.objects.get((model_class, uid))
+
+    def add(self, obj):
+        self.objects[(obj.__class__, obj.uid)] = obj
+
+    def discard(self, obj):
+        key = (obj.__class__, obj.uid)
+        if self.objects.get(key) is obj:
+            del self.objects[key]
+
+    def clear(self):
+        self.objects.clear()
+
+    def __len__(self):
+        return len(self.objects)
+
+
+def get_identity_map():
+    """
+    Returns the active ``IdentityMap`` of the current thread or ``None``.
+    """
+    return getattr(_local, 'identity_map', None)
+
+
+@contextmanager
+def identity_map():
+    """
+    Activates an identity map for the current thread, nested blocks
+    share the outer map.
+    """
+    current = get_identity_map()
+    if current is not None:
+        yield current
+        return
+
+    _local.identity_map = IdentityMap()
+    try:
+        yield _local.identity_map
+    finally:
+        _local.identity_map = None
+
+
+def get_mapped(model_class, uid):
+    current = get_identity_map()
+    if current is None:
+        return None
+    return current.get(model_class, uid)
+
+
+def add_mapped(obj):
+    current = get_identity_map()
+    if current is not None and obj.uid:
+        current.add(obj)
+
+
+class IdentityMapMiddleware(MiddlewareMixin):
+    """
+    Every request gets its own identity map.
+    """
+
+    def process_request(self, request):
+        _local.identity_map = IdentityMap()
+
+    def process_response(self, request, response):
+        _local.identity_map = None
+        return response
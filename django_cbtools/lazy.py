@@ -0,0 +1,93 @@
+"""
+Lazy documents, ``CBArticle(uid, lazy=True)`` doesn't request Sync-Gateway,
+the document is loaded on the first access to its fields. All the lazy
+documents waiting for loading in the current ``lazy_loads()`` block are
+loaded together with one ``_all_docs`` request::
+
+    with lazy_loads():
+        articles = [CBArticle(uid, lazy=True) for uid in uids]
+        articles[0].title  # loads all the articles
+
+Outside of the block the lazy documents of the current thread are loaded together.
+"""
+import threading
+import weakref
+from contextlib import contextmanager
+
+# dead references are dropped when the list grows twice since the last cleanup
+MIN_PRUNE_SIZE = 100
+
+_local = threading.local()
+
+
+class PendingList(object):
+    def __init__(self):
+        self.refs = []
+        self.prune_size = MIN_PRUNE_SIZE
+
+    def add(self, obj):
+        if len(self.refs) >= self.prune_size:
+            self.refs = [ref for ref in self.refs if _alive(ref)]
+            self.prune_size = max(MIN_PRUNE_SIZE, 2 * len(self.refs))
+        self.refs.append(weakref.ref(obj))
+
+    def pop(self):
+        refs, self.refs = self.refs, []
+        self.prune_size = MIN_PRUNE_SIZE
+        return refs
+
+    def __len__(self):
+        return len(self.refs)
+
+
+def _alive(ref):
+    obj = ref()
+    return obj is not None and obj.is_lazy()
+
+
+def get_pending():
+    """
+    Returns the ``PendingList`` of the current block, or of the thread outside of blocks.
+    """
+    pending = getattr(_local, 'scope', None)
+    if pending is None:
+        pending = getattr(_local, 'pending', None)
+        if pending is None:
+            pending = _local.pending = PendingList()
+    return pending
+
+
+@contextmanager
+def lazy_loads():
+    """
+    Lazy documents created in the block are loaded together, the ones
+    left at the end of the block are forgotten (each of them is loaded
+    alone on the first access). Nested blocks share the outer one.
+    """
+    if getattr(_local, 'scope', None) is not None:
+        yield
+        return
+
+    _local.scope = PendingList()
+    try:
+        yield
+    finally:
+        _local.scope = None
+
+
+def add_pending(obj):
+    get_pending().add(obj)
+
+
+def pop_pending():
+    """
+    Returns the lazy documents of the current block which are not loaded yet.
+    """
+    objects = []
+    seen = set()
+    for ref in get_pending().pop():
+        obj = ref()
+        if obj is not None and obj.is_lazy() and id(obj) not in seen:
+            seen.add(id(obj))
+            objects.append(obj)
+    return objects
@@ -0,0 +1,149 @@
+"""
+Batching of single document loads. Instead of loading documents one by one::
+
+    for order in orders:
+        order.customer = try_else_return_none_obj(order.customer_uid, CBCustomer)
+
+ask for them first and use them after, all of them are loaded with one ``_all_docs`` request::
+
+    with batch_loads():
+        customers = [load_later(order.customer_uid, CBCustomer) for order in orders]
+
+    for order, customer in zip(orders, customers):
+        order.customer = customer.result()
+
+See ``django_cbtools.aio.load_later`` for asyncio code.
+"""
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from django_cbtools import identity_map, sync_gateway
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+
+class Deferred(object):
+    """
+    Result of ``load_later``, the document (``None`` if it's not found)
+    is returned by ``result()``.
+    """
+
+    def __init__(self, loader):
+        self.loader = loader
+        self._done = False
+        self._value = None
+        self._error = None
+
+    def done(self):
+        return self._done
+
+    def set_result(self, value):
+        self._value = value
+        self._done = True
+
+    def set_exception(self, error):
+        self._error = error
+        self._done = True
+
+    def result(self):
+        """
+        Returns the document, loads it with all the other pending documents if needed.
+        """
+        if not self._done:
+            self.loader.dispatch()
+        if self._error is not None:
+            raise self._error
+        return self._value
+
+
+class Loader(object):
+    """
+    Collects documents to load, ``dispatch()`` loads all of them at once.
+    The same document asked several times gives the same ``Deferred``.
+    """
+
+    def __init__(self):
+        self.pending = OrderedDict()
+
+    def load(self, uid, model_class):
+        key = (model_class, uid)
+        deferred = self.pending.get(key)
+        if deferred is not None:
+            return deferred
+
+        deferred = Deferred(self)
+
+        obj = identity_map.get_mapped(model_class, uid) if uid else None
+        if obj is not None or not uid:
+            deferred.set_result(obj)
+            return deferred
+
+        self.pending[key] = deferred
+        return deferred
+
+    def dispatch(self):
+        pending, self.pending = self.pending, OrderedDict()
+        if not pending:
+            return
+
+        uids = list(OrderedDict((uid, None) for model_class, uid in pending))
+        try:
+            d = sync_gateway.SyncGateway.all_docs(uids)
+            resolve(pending, dict(zip(uids, d['rows'])))
+        except Exception as e:
+            for deferred in pending.values():
+                if not deferred.done():
+                    deferred.set_exception(e)
+            raise
+
+
+def resolve(pending, rows):
+    """
+    Sets results of ``pending`` dictionary ``{(model class, uid): deferred}``
+    from the loaded ``rows`` dictionary ``{uid: row}``.
+    """
+    from django_cbtools.models import objects_from_rows
+
+    for (model_class, uid), deferred in pending.items():
+        if deferred.done():
+            # cancelled asyncio future
+            continue
+        deferred.set_result(next(objects_from_rows([rows[uid]], model_class), None))
+
+
+def get_loader():
+    """
+    Returns ``Loader`` of the current ``batch_loads()`` block, or of the
+    thread outside of blocks.
+    """
+    loader = getattr(_local, 'block', None) or getattr(_local, 'loader', None)
+    if loader is None:
+        loader = _local.loader = Loader()
+    return loader
+
+
+def load_later(uid, model_class):
+    """
+    Batched version of ``try_else_return_none_obj``, returns ``Deferred``.
+    """
+    return get_loader().load(uid, model_class)
+
+
+@contextmanager
+def batch_loads():
+    """
+    Loads documents asked with ``load_later`` in the block at the end of
+    it (if they were not loaded by ``result()`` calls before). Nothing is
+    loaded when the block raises an exception.
+    """
+    outer = getattr(_local, 'block', None)
+    loader = _local.block = Loader()
+    try:
+        yield loader
+    finally:
+        _local.block = outer
+    loader.dispatch()
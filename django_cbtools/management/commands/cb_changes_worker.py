@@ -0,0 +1,44 @@
+from django_cbtools.changes import ChangesConsumer
+from django_cbtools.checkpoint import FileCheckpoint
+
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Reads Sync-Gateway changes feed and sends cb_changes signals.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--name', default='default',
+                            help='Consumer name, every consumer has its own checkpoint.')
+        parser.add_argument('--feed', default='longpoll', choices=['longpoll', 'continuous'])
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help='Maximum number of changes dispatched at once (default: 100).')
+        parser.add_argument('--timeout', type=int, default=60000,
+                            help='Milliseconds to wait for new changes (default: 60000).')
+        parser.add_argument('--checkpoint', default=None,
+                            help='File to store the last processed sequence in.')
+        parser.add_argument('--since', default=None,
+                            help='Start from this sequence instead of the saved one, "0" replays everything.')
+        parser.add_argument('--once', action='store_true', default=False,
+                            help='Process the available changes and exit.')
+
+    def handle(self, *args, **options):
+        checkpoint = FileCheckpoint(options['checkpoint']) if options['checkpoint'] else None
+
+        consumer = ChangesConsumer(name=options['name'],
+                                   feed=options['feed'],
+                                   batch_size=options['batch_size'],
+                                   timeout=options['timeout'],
+                                   checkpoint=checkpoint)
+
+        if options['since'] is not None:
+            consumer.since = options['since']
+
+        self.stdout.write('reading changes since %s' % consumer.since)
+
+        try:
+            consumer.run(once=options['once'])
+        except KeyboardInterrupt:
+            pass
+
+        self.stdout.write('stopped at %s' % consumer.since)
@@ -1,24 +1,116 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta
 
-from couchbase.views.params import Query
-
-from django_cbtools.models import get_stale, CouchbaseModel, query_view
-from django_cbtools.sync_gateway import SyncGateway
+from django_cbtools.checkpoint import FileCheckpoint
+from django_cbtools.models import iter_view_pages
+from django_cbtools.sync_gateway import SyncGateway, SyncGatewayBulkError
 
 from django.core.management.base import BaseCommand
 from django.utils import timezone
 
 
 class Command(BaseCommand):
+    help = 'Really deletes documents which were soft deleted (st_deleted) more than --days ago.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=30,
+                            help='Delete documents updated more than DAYS days ago (default: 30).')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Number of documents deleted with one _bulk_docs request (default: 500).')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Number of batches deleted concurrently (default: 1).')
+        parser.add_argument('--rate', type=float, default=0,
+                            help='Maximum number of deleted documents per second, 0 means no limit.')
+        parser.add_argument('--checkpoint', default=None,
+                            help='File to store the progress in, an interrupted run continues from it.')
+        parser.add_argument('--reset', action='store_true', default=False,
+                            help='Ignore the saved progress and start from the beginning.')
+        parser.add_argument('--dry-run', action='store_true', default=False,
+                            help='Only count the documents, delete nothing.')
+
     def handle(self, *args, **options):
-        latest_modification_time = timezone.now() - timedelta(days=30)
+        latest_modification_time = timezone.now() - timedelta(days=options['days'])
         date_to = latest_modification_time.date().isoformat()
 
-        for uid in self.get_uids(date_to):
-            o = CouchbaseModel(uid)
-            # print 'will delete %s / %s' % (uid, o.rev)
-            SyncGateway.delete_document(uid, o.rev)
+        batch_size = options['batch_size']
+        dry_run = options['dry_run']
+        rate = options['rate']
+        if options['checkpoint']:
+            checkpoint = FileCheckpoint(options['checkpoint'])
+        else:
+            checkpoint = FileCheckpoint.for_name('clear_st_deleted')
+
+        cursor = None if options['reset'] or dry_run else checkpoint.load()
+        if cursor is not None:
+            self.stdout.write('continue from %s / %s' % tuple(cursor))
+
+        started = time.time()
+        found = deleted = failed = 0
+        pending = []
+
+        with ThreadPoolExecutor(max(options['workers'], 1)) as executor:
+            for rows, next_cursor in iter_view_pages('deleted_documents', batch_size,
+                                                     cursor=cursor, endkey=date_to):
+                revs = self.get_revs([x.docid for x in rows])
+                found += len(revs)
+
+                if dry_run:
+                    continue
+
+                pending.append((executor.submit(self.delete, revs), next_cursor))
+
+                # keep a bounded number of batches in flight, finished
+                # batches move the checkpoint forward in the view order
+                while pending and (pending[0][0].done() or len(pending) > options['workers']):
+                    future, done_cursor = pending.pop(0)
+                    ok, errors = future.result()
+                    deleted += ok
+                    failed += errors
+                    self.write_checkpoint(checkpoint, done_cursor)
+
+                if rate:
+                    delay = found / rate - (time.time() - started)
+                    if delay > 0:
+                        time.sleep(delay)
+
+            for future, done_cursor in pending:
+                ok, errors = future.result()
+                deleted += ok
+                failed += errors
+                self.write_checkpoint(checkpoint, done_cursor)
+
+        if dry_run:
+            self.stdout.write('%d documents to delete' % found)
+        else:
+            self.stdout.write('%d documents deleted, %d failed' % (deleted, failed))
+
+    def get_revs(self, uids):
+        """
+        Returns list of ``(uid, rev)`` tuples of existing documents.
+        """
+        d = SyncGateway.all_docs(uids, include_docs=False)
+        return [(x['id'], x['value']['rev']) for x in d['rows'] if 'error' not in x]
+
+    def delete(self, revs):
+        """
+        Returns tuple (number of deleted, number of failed documents).
+        """
+        if not revs:
+            return 0, 0
+
+        try:
+            SyncGateway.bulk_delete(revs)
+        except SyncGatewayBulkError as e:
+            for error in e.errors:
+                self.stderr.write('can not delete %s: %s %s' % (error['id'], error['status'], error['reason']))
+            return len(revs) - len(e.errors), len(e.errors)
+
+        return len(revs), 0
 
-    def get_uids(self, date_string):
-        query = Query(endkey=date_string, stale=get_stale())
-        return query_view('deleted_documents', None, query=query)
+    def write_checkpoint(self, checkpoint, cursor):
+        if cursor is None:
+            # everything is done
+            checkpoint.clear()
+        else:
+            checkpoint.save(list(cursor))
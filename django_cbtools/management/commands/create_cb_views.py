@@ -1,6 +1,6 @@
 from django.core.management.base import BaseCommand
 
-from django_cbtools.connection import connection
+from django_cbtools.connection import pooled_connection
 
 
 class Command(BaseCommand):
@@ -35,8 +35,9 @@ class Command(BaseCommand):
                         pass
 
             if views:
-                connection().design_create(app_config.label, {"views": views})
-                connection().design_publish(app_config.label)
+                with pooled_connection() as conn:
+                    conn.design_create(app_config.label, {"views": views})
+                    conn.design_publish(app_config.label)
 
                 # print 'created %d views for %s: %s' % (len(views), app_config.label, views.keys())
         except:
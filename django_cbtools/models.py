@@ -1,15 +1,18 @@
 from datetime import datetime
 from decimal import Decimal
 import calendar
+import copy
+import hashlib
+import json
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from six import string_types
 import logging
 import pytz
 
 from django.db import models
-from django.forms.models import model_to_dict
 from django.utils import timezone, dateparse
 from django.db.models.fields.files import FileField
-from django.db.models.fields import DateTimeField, DecimalField
 from django.conf import settings
 
 from couchbase.views.iterator import View
@@ -19,8 +22,8 @@ from tastypie.serializers import Serializer
 
 from django_extensions.db.fields import ShortUUIDField
 
-from django_cbtools import sync_gateway
-from django_cbtools.connection import connection
+from django_cbtools import batch, identity_map, lazy, serialization, sync_gateway
+from django_cbtools.connection import pooled_connection
 from django_cbtools.signals import cb_pre_save, cb_post_save, cb_pre_delete, cb_post_delete
 logger = logging.getLogger(__name__)
 
@@ -29,6 +32,8 @@ DOC_TYPE_FIELD_NAME = "doc_type"
 
 CHANNEL_PUBLIC = 'public'
 
+DEFAULT_QUERY_PAGE_SIZE = 500
+
 
 class CouchbaseModelError(Exception):
     pass
@@ -40,6 +45,10 @@ class CouchbaseModel(models.Model):
 
     uid_prefix = 'st'
     doc_type = None
+    # ``Model(uid)`` doesn't load the document until its fields are used
+    lazy_load = False
+    # remember a hash of loaded / saved documents, see ``has_changes()``
+    track_changes = False
     _serializer = Serializer()
 
     created = models.DateTimeField()
@@ -50,10 +59,25 @@ class CouchbaseModel(models.Model):
         if isinstance(other, self.__class__):
             return self.get_uid() == other.get_uid()
 
+    def __new__(cls, *args, **kwargs):
+        # ``Model(uid)`` returns the instance already loaded in the active identity map
+        if len(args) == 1 and set(kwargs) <= {'lazy'} and isinstance(args[0], string_types):
+            obj = identity_map.get_mapped(cls, args[0])
+            if obj is not None:
+                obj._identity_mapped = True
+                return obj
+        return super(CouchbaseModel, cls).__new__(cls)
+
     def __init__(self, *args, **kwargs):
+        if self.__dict__.pop('_identity_mapped', False):
+            # the instance is taken from the identity map, it's loaded already
+            return
+
         self.channels = []
         self.uid = None
         self.rev = None
+        is_lazy = kwargs.pop('lazy', self.lazy_load)
+
         if 'uid_prefix' in kwargs:
             self.uid_prefix = kwargs['uid_prefix']
             del kwargs['uid_prefix']
@@ -77,7 +101,65 @@ class CouchbaseModel(models.Model):
         if len(args) == 1:
             v = args[0]
             if isinstance(v, string_types):
-                self.load(v)
+                if is_lazy:
+                    self._make_lazy(v)
+                else:
+                    self.load(v)
+
+    def __getattr__(self, name):
+        # ``channels`` and ``rev`` of a lazy document are set when it's loaded
+        if name in ('channels', 'rev') and self.is_lazy():
+            self.refresh_from_db()
+            return getattr(self, name)
+        raise AttributeError("'%s' object has no attribute '%s'" % (self.__class__.__name__, name))
+
+    def _make_lazy(self, uid):
+        self.uid = uid
+        # without values in the instance dictionary the field descriptors call ``refresh_from_db``
+        names = [f.attname for f in self._meta.fields] + ['channels', 'rev']
+        self._lazy_defaults = {name: self.__dict__.pop(name) for name in names if name in self.__dict__}
+        lazy.add_pending(self)
+        identity_map.add_mapped(self)
+
+    def is_lazy(self):
+        """
+        ``True`` for a lazy document which is not loaded yet.
+        """
+        return '_lazy_defaults' in self.__dict__
+
+    def refresh_from_db(self, using=None, fields=None):
+        """
+        Loads the lazy document together with all the other lazy documents
+        waiting for loading, reloads the document if it isn't lazy.
+        """
+        if not self.is_lazy():
+            self.load(self.uid)
+            return
+
+        objects = lazy.pop_pending()
+        if not any(x is self for x in objects):
+            objects.append(self)
+
+        d = sync_gateway.SyncGateway.all_docs([x.uid for x in objects])
+        for obj, row in zip(objects, d['rows']):
+            obj._resolve_lazy(row)
+
+        if self.is_lazy():
+            raise self._lazy_error
+
+    def _resolve_lazy(self, row):
+        if 'error' in row:
+            self._lazy_error = sync_gateway.SyncGatewayException(row)
+            return
+
+        self.__dict__.pop('_lazy_error', None)
+        defaults = self.__dict__.pop('_lazy_defaults')
+
+        # values assigned before loading win over the loaded ones
+        assigned = dict(self.__dict__)
+        self.__dict__.update(defaults)
+        self.from_sync_gateway_row(row)
+        self.__dict__.update(assigned)
 
     def append_to_references_list(self, key, value):
         v = getattr(self, key, [])
@@ -123,21 +205,7 @@ class CouchbaseModel(models.Model):
         self.from_dict(d)
 
     def from_dict(self, dict_payload):
-
-        for field in self._meta.fields:
-            if field.name not in dict_payload:
-                continue
-            if isinstance(field, DateTimeField):
-                self._date_from_string(field.name, dict_payload.get(field.name))
-            elif isinstance(field, DecimalField):
-                self._decimal_from_string(field.name, dict_payload.get(field.name))
-            elif field.name in dict_payload:
-                setattr(self, field.name, dict_payload[field.name])
-
-        # converts values into decimal object
-        # self._values_to_decimal(dict_payload)
-        if CHANNELS_FIELD_NAME in dict_payload.keys():
-            self.channels = dict_payload[CHANNELS_FIELD_NAME]
+        serialization.get_decoder(self.__class__).decode(self, dict_payload)
 
     def _date_from_string(self, field_name, val):
         try:
@@ -175,13 +243,82 @@ class CouchbaseModel(models.Model):
         return parent_dict
 
     def save(self, *args, **kwargs):
-        if not len(self.channels):
-            raise CouchbaseModelError('Empty channels list can not be saved')
+        """
+        Saves the document. With ``only_if_changed=True`` a document
+        without changes (see ``has_changes()``) is not saved.
+        """
+        if kwargs.get('only_if_changed') and not self.has_changes():
+            return
+
+        current_batch = batch.get_batch()
+        if current_batch is not None:
+            # written at the end of ``cb_batch()`` block
+            self._check_channels()
+            current_batch.add(self)
+            return
 
         # Set is_new_document before save so we know if its a new document being saved
+        is_new_document = self._before_save()
+
+        sync_gateway.SyncGateway.save_document(self)
+        identity_map.add_mapped(self)
+        self._take_snapshot()
+
+        # Send signal document was saved, set is created to True if its a new document being saved
+        cb_post_save.send(sender=self.__class__, instance=self, created=is_new_document)
+
+    @classmethod
+    def bulk_save(cls, instances, chunk_size=None, only_if_changed=False):
+        """
+        Saves all the ``instances`` with a few ``_bulk_docs`` requests
+        instead of one request per document. Signals are sent as for ``save()``.
+        ``cb_post_save`` is not sent for documents which failed, they are
+        listed in ``SyncGatewayBulkError.errors``.
+        """
+        instances = list(instances)
+        if only_if_changed:
+            instances = [x for x in instances if x.has_changes()]
+        if not instances:
+            return
+        created = [instance._before_save() for instance in instances]
+        cls._bulk_write(instances, created, chunk_size)
+
+    @classmethod
+    def _bulk_write(cls, instances, created, chunk_size=None):
+        """
+        Writes prepared ``instances`` and sends ``cb_post_save``,
+        ``created`` tells which of them are new.
+        """
+        try:
+            sync_gateway.SyncGateway.bulk_save(instances, chunk_size=chunk_size)
+        except sync_gateway.SyncGatewayBulkError as e:
+            failed = set(id(x['document']) for x in e.errors)
+            for instance in instances:
+                if id(instance) not in failed:
+                    identity_map.add_mapped(instance)
+                    instance._take_snapshot()
+            cls._send_post_save([x for x in zip(instances, created) if id(x[0]) not in failed])
+            raise
+
+        for instance in instances:
+            identity_map.add_mapped(instance)
+            instance._take_snapshot()
+        cls._send_post_save(zip(instances, created))
+
+    @staticmethod
+    def _send_post_save(saved):
+        for instance, is_new_document in saved:
+            cb_post_save.send(sender=instance.__class__, instance=instance, created=is_new_document)
+
+    def _before_save(self):
+        """
+        Prepares the document for saving, returns ``True`` for a new document.
+        """
+        self._check_channels()
+
         is_new_document = self.is_new()
 
-        # Send signal before save 
+        # Send signal before save
         cb_pre_save.send(sender=self.__class__, instance=self)
 
         self.updated = timezone.now()
@@ -198,15 +335,39 @@ class CouchbaseModel(models.Model):
                     logger.debug('will save the file to %s' % file_field.name)
                     file_field.save(file_field.name, file_field, False)
 
-        sync_gateway.SyncGateway.save_document(self)
-        
-        # Send signal document was saved, set is created to True if its a new document being saved
-        cb_post_save.send(sender=self.__class__, instance=self, created=is_new_document)
+        return is_new_document
+
+    def _check_channels(self):
+        if not len(self.channels):
+            raise CouchbaseModelError('Empty channels list can not be saved')
 
     def load(self, uid):
         d = sync_gateway.SyncGateway.all_docs([uid])
         row = d['rows'][0]
         self.from_sync_gateway_row(row)
+        identity_map.add_mapped(self)
+
+    @classmethod
+    def aload(cls, uid):
+        """
+        Coroutine loading the document: ``obj = await Model.aload(uid)``.
+        """
+        from django_cbtools import aio
+        return aio.load(cls, uid)
+
+    def asave(self):
+        """
+        Coroutine version of ``save()``: ``await obj.asave()``.
+        """
+        from django_cbtools import aio
+        return aio.save(self)
+
+    def adelete(self):
+        """
+        Coroutine version of ``delete()``: ``await obj.adelete()``.
+        """
+        from django_cbtools import aio
+        return aio.delete(self)
 
     def from_sync_gateway_row(self, row):
         if 'error' in row:
@@ -214,25 +375,36 @@ class CouchbaseModel(models.Model):
         self.from_dict(row['doc'])
         self.uid = row['id']
         self.rev = row['value']['rev']
+        self._take_snapshot()
         # self.doc_type = row['doc']['doc_type']
 
+    def has_changes(self):
+        """
+        ``True`` if the document was changed after it was loaded or saved.
+        It's always ``True`` for new documents and for models
+        without ``track_changes``.
+        """
+        if self.is_lazy():
+            self.refresh_from_db()
+        snapshot = self.__dict__.get('_snapshot')
+        return snapshot is None or snapshot != self._payload_hash()
+
+    def _take_snapshot(self):
+        if self.track_changes:
+            self._snapshot = self._payload_hash()
+
+    def _payload_hash(self):
+        d = self.to_dict()
+        # bumped by every save
+        d.pop('updated', None)
+        return hashlib.sha1(json.dumps(d, sort_keys=True).encode('utf-8')).hexdigest()
+
     def to_json(self):
         d = self.to_dict()
         return self._serializer.to_json(d)
 
     def to_dict(self):
-        d = model_to_dict(self)
-        tastyjson = self._serializer.to_json(d)
-        d = self._serializer.from_json(tastyjson)
-
-        d[DOC_TYPE_FIELD_NAME] = self.get_doc_type()
-        d[CHANNELS_FIELD_NAME] = self.channels
-
-        for field in self._meta.fields:
-            if isinstance(field, DateTimeField):
-                d[field.name] = self._string_from_date(field.name)
-
-        return d
+        return serialization.get_encoder(self.__class__).encode(self)
 
     def get_doc_type(self):
         if self.doc_type:
@@ -251,6 +423,14 @@ class CouchbaseModel(models.Model):
         """
         cb_pre_delete.send(sender=self.__class__, instance=self)
         self.st_deleted = True
+
+        current_batch = batch.get_batch()
+        if current_batch is not None:
+            # ``cb_post_delete`` is sent when the batch is written
+            self._check_channels()
+            current_batch.add(self, deleted=True)
+            return
+
         self.save()
         cb_post_delete.send(sender=self.__class__, instance=self)
 
@@ -270,11 +450,7 @@ class CouchbaseNestedModel(CouchbaseModel):
         abstract = True
 
     def to_dict(self):
-        d = model_to_dict(self)
-        tastyjson = self._serializer.to_json(d)
-        d = self._serializer.from_json(tastyjson)
-        d['uid'] = self.get_uid()
-        return d
+        return serialization.get_encoder(self.__class__, nested=True).encode(self)
 
     def from_dict(self, dict_payload):
         super(CouchbaseNestedModel, self).from_dict(dict_payload)
@@ -284,26 +460,24 @@ class CouchbaseNestedModel(CouchbaseModel):
     def save(self, *args, **kwargs):
         raise CouchbaseModelError('this object is not supposed to be saved, it is nested')
 
+    def _before_save(self):
+        raise CouchbaseModelError('this object is not supposed to be saved, it is nested')
+
     def load(self, uid):
         raise CouchbaseModelError('this object is not supposed to be loaded, it is nested')
 
 
-def load_objects(keys, class_name):
+def load_objects(keys, class_name, values=False, named=False, fields=None):
     """
     Create list of objects of given class_name.
-    """
-    json = sync_gateway.SyncGateway.all_docs(keys)
 
-    objs = []
-    for row in json['rows']:
-        try:
-            obj = class_name()
-            obj.from_sync_gateway_row(row)
-            objs.append(obj)
-        except sync_gateway.SyncGatewayException as e:
-            logger.warning('Could not load key from database. Error : %s', str(e))
-
-    return objs
+    With ``values`` it returns dictionaries instead of objects, with ``named``
+    named tuples, ``fields`` limits the fields in them (see ``values_from_rows``).
+    """
+    if values or named or fields is not None:
+        rows = sync_gateway.SyncGateway.all_docs(keys)['rows']
+        return list(values_from_rows(rows, class_name, fields=fields, named=named))
+    return list(objects_from_rows(_load_rows(keys, class_name), class_name))
 
 
 def load_objects_dict(keys, class_name):
@@ -311,18 +485,109 @@ def load_objects_dict(keys, class_name):
     Creates dictionary (instead of list)
     of obejct of given ``class_name``.
     """
-    json = sync_gateway.SyncGateway.all_docs(keys)
+    return {obj.uid: obj for obj in objects_from_rows(_load_rows(keys, class_name), class_name)}
+
+
+def _load_rows(keys, class_name):
+    """
+    Returns Sync-Gateway rows for ``keys`` in the same order. Every key is
+    requested once, documents of the active identity map are not requested.
+    """
+    if not keys:
+        return []
+    keys = list(keys)
+    current = identity_map.get_identity_map()
+
+    fetch = []
+    seen = set()
+    for key in keys:
+        if key in seen or (current is not None and current.get(class_name, key) is not None):
+            continue
+        seen.add(key)
+        fetch.append(key)
+
+    if len(fetch) == len(keys):
+        return sync_gateway.SyncGateway.all_docs(keys)['rows'] if keys else []
+
+    rows = {}
+    if fetch:
+        rows = dict(zip(fetch, sync_gateway.SyncGateway.all_docs(fetch)['rows']))
+
+    result = []
+    used = set()
+    for key in keys:
+        row = rows.get(key)
+        if row is None:
+            # mapped document, ``objects_from_rows`` takes it from the identity map
+            row = {'id': key}
+        elif key in used:
+            # repeated key, its objects must not share lists and dicts
+            row = copy.deepcopy(row)
+        used.add(key)
+        result.append(row)
+    return result
+
+
+def iter_objects(keys, class_name):
+    """
+    Yields objects of given ``class_name`` one by one, as they are
+    decoded from Sync-Gateway response. Use it instead of ``load_objects``
+    for big amounts of keys.
+    """
+    return objects_from_rows(sync_gateway.SyncGateway.iter_all_docs(keys), class_name)
+
+
+def objects_from_rows(rows, class_name):
+    """
+    Yields objects of given ``class_name`` for Sync-Gateway ``rows``,
+    rows with errors are logged and skipped.
+    """
+    current = identity_map.get_identity_map()
+
+    for row in rows:
+        if current is not None and 'id' in row:
+            obj = current.get(class_name, row['id'])
+            if obj is not None:
+                yield obj
+                continue
 
-    objs = {}
-    for row in json['rows']:
         try:
             obj = class_name()
             obj.from_sync_gateway_row(row)
-            objs[obj.uid] = obj
         except sync_gateway.SyncGatewayException as e:
             logger.warning('Could not load key from database. Error : %s', str(e))
+            continue
 
-    return objs
+        if current is not None:
+            current.add(obj)
+        yield obj
+
+
+def values_from_rows(rows, class_name, fields=None, named=False):
+    """
+    Yields dictionaries (or named tuples with ``named``) with ``uid``
+    and ``fields`` values of documents in Sync-Gateway ``rows``.
+    It's much cheaper than creating model instances, only datetime and
+    decimal fields are converted, ``from_dict`` of the model is not used.
+    ``fields`` are all the fields and ``channels`` by default,
+    ``rev`` can be requested too.
+    """
+    decoder = serialization.get_values_decoder(class_name, fields)
+    decode = decoder.decode_row if named else decoder.decode_dict
+
+    for row in rows:
+        if 'error' in row or not row.get('doc'):
+            logger.warning('Could not load key from database. Error : %s', row)
+            continue
+        yield decode(row)
+
+
+def aload_objects(keys, class_name):
+    """
+    Coroutine version of ``load_objects``.
+    """
+    from django_cbtools import aio
+    return aio.load_objects(keys, class_name)
 
 
 def load_related_objects(objects, related_name, related_class, related_name_suffix='_uid'):
@@ -338,18 +603,294 @@ def load_related_objects(objects, related_name, related_class, related_name_suff
         setattr(o, related_name, related_hash.get(getattr(o, related_key)))
 
 
+class Prefetch(object):
+    """
+    Lookup for ``prefetch`` with the class of related documents,
+    for documents which ``doc_type`` doesn't tell the class.
+    """
+
+    def __init__(self, lookup, model_class=None):
+        self.lookup = lookup
+        self.model_class = model_class
+
+
+def prefetch(objects, *lookups):
+    """
+    Loads related documents of ``objects`` and sets them as attributes::
+
+        prefetch(articles, 'author', 'author__company', 'tags_uids')
+
+    ``author`` is loaded by ``author_uid`` attribute (or ``author_uids`` list)
+    and set to ``author`` attribute, ``tags_uids`` list of uids gives ``tags``
+    list. ``__`` follows relations of the related documents. Every level
+    is loaded with one ``_all_docs`` request, every document once.
+    The classes are found by ``doc_type`` of the documents, use
+    ``Prefetch(lookup, model_class)`` to set them explicitly.
+    """
+    classes = OrderedDict()
+    for lookup in lookups:
+        if not isinstance(lookup, Prefetch):
+            lookup = Prefetch(lookup)
+        parts = tuple(lookup.lookup.split('__'))
+        for i in range(1, len(parts) + 1):
+            classes.setdefault(parts[:i], None)
+        if lookup.model_class is not None:
+            classes[parts] = lookup.model_class
+
+    level_objects = {(): OrderedDict((id(x), x) for x in objects)}
+    loaded = {}
+
+    depth = 1
+    while True:
+        paths = [x for x in classes if len(x) == depth]
+        if not paths:
+            return
+
+        relations = []
+        keys = OrderedDict()
+        for path in paths:
+            for obj in level_objects.get(path[:-1], {}).values():
+                target, uids, many = _related_uids(obj, path[-1])
+                relations.append((path, obj, target, uids, many))
+                for uid in uids:
+                    if (classes[path], uid) not in loaded:
+                        keys[uid] = None
+
+        rows = {}
+        if keys:
+            d = sync_gateway.SyncGateway.all_docs(list(keys))
+            rows = dict(zip(keys, d['rows']))
+
+        for path, obj, target, uids, many in relations:
+            related = []
+            for uid in uids:
+                key = (classes[path], uid)
+                if key not in loaded:
+                    loaded[key] = _related_object(rows[uid], classes[path])
+                if loaded[key] is not None:
+                    related.append(loaded[key])
+
+            setattr(obj, target, related if many else (related[0] if related else None))
+
+            # the next level follows relations of the distinct related objects
+            level = level_objects.setdefault(path, OrderedDict())
+            for x in related:
+                level[id(x)] = x
+
+        depth += 1
+
+
+def _related_uids(obj, name):
+    """
+    Returns tuple (attribute name for related objects, list of uids, ``True`` for a list).
+    """
+    for suffix, many in (('_uids', True), ('_uid', False)):
+        if name.endswith(suffix):
+            target = name[:-len(suffix)]
+            value = getattr(obj, name, None)
+            break
+    else:
+        target = name
+        many = hasattr(obj, name + '_uids') and not hasattr(obj, name + '_uid')
+        value = getattr(obj, name + ('_uids' if many else '_uid'), None)
+
+    if many:
+        return target, [x for x in (value or []) if x], True
+    return target, [value] if value else [], False
+
+
+def _related_object(row, model_class):
+    # removed and deleted documents come with ``"doc": null``
+    if 'error' in row or not row.get('doc'):
+        logger.warning('Could not load key from database. Error : %s', row)
+        return None
+    if model_class is None:
+        model_class = get_model_class(row['doc'].get(DOC_TYPE_FIELD_NAME))
+    return next(objects_from_rows([row], model_class), None)
+
+
+_model_classes = {}
+
+
+def get_model_class(doc_type):
+    """
+    Returns ``CouchbaseModel`` subclass with given ``doc_type``.
+    """
+    model_class = _model_classes.get(doc_type)
+    if model_class is None:
+        _model_classes.clear()
+        _model_classes.update(_find_model_classes())
+        model_class = _model_classes.get(doc_type)
+
+    if model_class is None:
+        raise CouchbaseModelError('No model for doc_type %s, use Prefetch(lookup, model_class)' % doc_type)
+    if isinstance(model_class, list):
+        raise CouchbaseModelError('Several models for doc_type %s (%s), use Prefetch(lookup, model_class)' % (
+            doc_type, ', '.join(x.__name__ for x in model_class)))
+    return model_class
+
+
+def _find_model_classes():
+    """
+    Returns ``{doc_type: class}``, a subclass inheriting ``doc_type`` of its
+    parent doesn't compete with the class defining it. Several classes
+    defining the same ``doc_type`` are given as a list.
+    """
+    found = {}
+    stack = list(CouchbaseModel.__subclasses__())
+    while stack:
+        cls = stack.pop()
+        stack.extend(cls.__subclasses__())
+        if issubclass(cls, CouchbaseNestedModel):
+            continue
+        doc_type = cls.doc_type or cls.__name__.lower()
+        found.setdefault(doc_type, []).append(cls)
+
+    for doc_type, classes in found.items():
+        classes = [x for x in classes if 'doc_type' in x.__dict__ or not x.doc_type] or classes
+        found[doc_type] = classes[0] if len(classes) == 1 else classes
+    return found
+
+
 # moved functions
+def rows_query(query):
+    """
+    Returns a copy of ``Query`` asking for the rows, not the output of
+    the reduce function of the view.
+    """
+    return query.update(copy=True, reduce=False)
+
+
 def query_view(view_name, query_key, query=None):
     design, v = parse_view_name(view_name)
-    query = query or Query(key=query_key, stale=get_stale())
-    result = View(connection(), design, v, query=query)
-    result_keys = [x.docid for x in result]
+    # rows of views with reduce function too
+    query = rows_query(query) if query is not None else Query(key=query_key, stale=get_stale(), reduce=False)
+    with pooled_connection() as conn:
+        result_keys = [x.docid for x in View(conn, design, v, query=query)]
     return result_keys
 
 
-def query_objects(view_name, query_key, class_name, query=None):
+def reduce_view(view_name, group_level=None, **params):
+    """
+    Returns output of the reduce function of the view, no documents are loaded.
+    Without ``group_level`` (and ``group``) it's one value for all the rows
+    (``None`` if there are no rows), otherwise a list of ``(key, value)`` pairs.
+    ``params`` are ``couchbase.views.params.Query`` parameters (``key``,
+    ``startkey``, ``endkey``, ...).
+    """
+    design, v = parse_view_name(view_name)
+
+    params.setdefault('stale', get_stale())
+    params['reduce'] = True
+    if group_level is not None:
+        params['group_level'] = group_level
+
+    with pooled_connection() as conn:
+        rows = list(View(conn, design, v, query=Query(**params)))
+
+    if group_level is None and not params.get('group'):
+        return rows[0].value if rows else None
+    return [(x.key, x.value) for x in rows]
+
+
+def count_view(view_name, query_key=None, **params):
+    """
+    Returns number of the view rows with ``query_key``, the view must
+    have ``_count`` reduce function (like ``by_channel`` and ``by_type``).
+    """
+    if query_key is not None:
+        params['key'] = query_key
+    return reduce_view(view_name, **params) or 0
+
+
+def aquery_view(view_name, query_key, query=None):
+    """
+    Coroutine version of ``query_view``, the view is queried with
+    the views REST API, without blocking the event loop.
+    """
+    from django_cbtools import aio
+    return aio.query_view(view_name, query_key, query=query)
+
+
+def iter_view_pages(view_name, page_size, cursor=None, **params):
+    """
+    Pages through the view rows using keyset pagination (``startkey`` and
+    ``startkey_docid``, never ``skip``), so every page costs the same.
+    ``params`` are ``couchbase.views.params.Query`` parameters (``key``,
+    ``startkey``, ``endkey``, ...).
+
+    Yields tuples ``(rows, cursor)``, ``cursor`` is a ``(key, docid)`` pair
+    the next page starts with (``None`` for the last page). Pass it as
+    ``cursor`` to continue from that place.
+    """
+    design, v = parse_view_name(view_name)
+
+    if 'key' in params:
+        key = params.pop('key')
+        params['startkey'] = key
+        params['endkey'] = key
+
+    params.setdefault('stale', get_stale())
+    params.setdefault('reduce', False)
+
+    while True:
+        query_params = dict(params, limit=page_size + 1)
+        if cursor is not None:
+            query_params['startkey'], query_params['startkey_docid'] = cursor
+
+        # the connection is not kept while the caller handles the page
+        with pooled_connection() as conn:
+            rows = list(View(conn, design, v, query=Query(**query_params)))
+
+        if len(rows) > page_size:
+            cursor = (rows[page_size].key, rows[page_size].docid)
+        else:
+            cursor = None
+
+        yield rows[:page_size], cursor
+
+        if cursor is None:
+            return
+
+
+def query_objects(view_name, query_key, class_name, query=None, values=False, named=False, fields=None):
     result = query_view(view_name, query_key=query_key, query=query)
-    return load_objects(result, class_name)
+    return load_objects(result, class_name, values=values, named=named, fields=fields)
+
+
+def iter_query_objects(view_name, query_key, class_name, page_size=DEFAULT_QUERY_PAGE_SIZE, **params):
+    """
+    Yields objects like ``query_objects``, but reads the view page by page
+    with ``iter_view_pages``. Documents of a page are loaded in a background
+    thread while the next page is read from the view, so the first objects
+    come before the whole view is read and memory usage doesn't depend on
+    the number of rows. ``params`` are passed to ``iter_view_pages``.
+    """
+    if query_key is not None:
+        params['key'] = query_key
+
+    with ThreadPoolExecutor(1) as executor:
+        loading = None
+        for rows, cursor in iter_view_pages(view_name, page_size, **params):
+            keys = [x.docid for x in rows]
+            following = executor.submit(sync_gateway.SyncGateway.all_docs, keys) if keys else None
+
+            if loading is not None:
+                for obj in objects_from_rows(loading.result()['rows'], class_name):
+                    yield obj
+            loading = following
+
+        if loading is not None:
+            for obj in objects_from_rows(loading.result()['rows'], class_name):
+                yield obj
+
+
+def aquery_objects(view_name, query_key, class_name, query=None):
+    """
+    Coroutine version of ``query_objects``.
+    """
+    from django_cbtools import aio
+    return aio.query_objects(view_name, query_key, class_name, query=query)
 
 
 def get_stale():
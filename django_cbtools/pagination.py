@@ -0,0 +1,216 @@
+"""
+Keyset pagination over Couchbase views. A page starts with the view row
+given by the cursor (``startkey`` and ``startkey_docid``), ``skip`` is never
+used, so the last page costs the same as the first one::
+
+    paginator = KeysetPaginator('by_channel', CBArticle, per_page=20, key=['channel_name', 'article'])
+    page = paginator.page(request.GET.get('cursor'))
+    for article in page:
+        ...
+    page.next_cursor  # opaque string for the next page, None for the last one
+
+Cursors are signed with ``SECRET_KEY`` for the view and the parameters of
+the paginator, so a client can't make a cursor reaching outside of them.
+"""
+import json
+from math import ceil
+
+from six import string_types
+
+from django.core import signing
+from django.core.paginator import InvalidPage
+
+from django_cbtools.models import count_view, iter_view_pages, load_objects
+
+DEFAULT_PER_PAGE = 20
+
+# parameters of the rows range counted by ``KeysetPaginator.count``
+RANGE_PARAMS = ('startkey', 'endkey', 'startkey_docid', 'endkey_docid', 'inclusive_end', 'descending', 'stale')
+
+CURSOR_SALT = 'django_cbtools.pagination'
+
+
+class InvalidCursor(InvalidPage):
+    pass
+
+
+def encode_cursor(cursor, salt=CURSOR_SALT):
+    """
+    Returns signed string token of ``(key, docid)`` cursor of ``iter_view_pages``.
+    """
+    if cursor is None:
+        return None
+    return signing.dumps(list(cursor), salt=salt)
+
+
+def decode_cursor(token, salt=CURSOR_SALT):
+    """
+    Returns ``(key, docid)`` cursor for the token made by ``encode_cursor``
+    with the same ``salt``.
+    """
+    if not token:
+        return None
+
+    try:
+        key, docid = signing.loads(str(token), salt=salt)
+    except (signing.BadSignature, TypeError, ValueError, UnicodeError):
+        raise InvalidCursor('Invalid cursor %r' % token)
+
+    if not isinstance(docid, string_types):
+        raise InvalidCursor('Invalid cursor %r' % token)
+    return key, docid
+
+
+def key_range(params):
+    """
+    Returns ``params`` with ``key`` replaced by ``startkey`` and ``endkey``.
+    """
+    params = dict(params)
+    if 'key' in params:
+        params['startkey'] = params['endkey'] = params.pop('key')
+    return params
+
+
+class Page(object):
+    """
+    Page of ``KeysetPaginator``. Keyset pages have no numbers: ``number``
+    is ``None``, ``next_page_number()`` and ``previous_page_number()`` return
+    the cursors, so templates written for Django pages work with
+    ``cursor_kwarg = 'page'``.
+    """
+    number = None
+
+    def __init__(self, object_list, cursor, next_cursor, paginator):
+        self.object_list = object_list
+        self.cursor = cursor
+        self.next_cursor = next_cursor
+        self.paginator = paginator
+        self._previous_cursor = False
+
+    def __repr__(self):
+        return '<Page %s>' % (self.cursor or 'first')
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+    @property
+    def previous_cursor(self):
+        """
+        Cursor of the previous page, ``''`` if it's the first page, ``None`` if
+        there is no previous page. It costs one view query.
+        """
+        if self._previous_cursor is False:
+            self._previous_cursor = self.paginator.previous_cursor(self.cursor)
+        return self._previous_cursor
+
+    def next_page_number(self):
+        if not self.has_next():
+            raise InvalidCursor('That page is the last one')
+        return self.next_cursor
+
+    def previous_page_number(self):
+        if not self.has_previous():
+            raise InvalidCursor('That page is the first one')
+        return self.previous_cursor
+
+
+class KeysetPaginator(object):
+    """
+    Pages of ``view_name`` rows, ``params`` are ``couchbase.views.params.Query``
+    parameters (``key``, ``startkey``, ``endkey``, ...). Pages contain objects of
+    ``class_name`` (loaded with one ``_all_docs`` request), or view rows
+    if ``class_name`` is ``None``.
+
+    ``count_view_name`` is a view with the same keys and ``_count`` reduce
+    function (usually ``view_name`` itself, like ``by_channel``), it's used
+    for ``count`` and ``num_pages``.
+    """
+
+    def __init__(self, view_name, class_name=None, per_page=DEFAULT_PER_PAGE, count_view_name=None, **params):
+        self.view_name = view_name
+        self.model = class_name
+        self.per_page = per_page
+        self.count_view_name = count_view_name
+        self.params = params
+        self._count = None
+
+    @property
+    def salt(self):
+        """
+        Salt of the cursors, a cursor of one paginator is invalid for the others.
+        """
+        params = json.dumps(self.params, sort_keys=True, default=str)
+        return '%s:%s:%s' % (CURSOR_SALT, self.view_name, params)
+
+    @property
+    def count(self):
+        """
+        Total number of rows, ``None`` without ``count_view_name``.
+        """
+        if self.count_view_name is None:
+            return None
+        if self._count is None:
+            # the same rows as the pages
+            params = dict((k, v) for k, v in key_range(self.params).items() if k in RANGE_PARAMS)
+            self._count = count_view(self.count_view_name, **params)
+        return self._count
+
+    @property
+    def num_pages(self):
+        if self.count is None:
+            return None
+        return max(1, int(ceil(self.count / float(self.per_page))))
+
+    def page(self, cursor=None):
+        """
+        Returns the page starting at ``cursor`` token, the first page if it's empty.
+        Raises ``InvalidCursor`` for broken tokens.
+        """
+        start = decode_cursor(cursor, self.salt)
+        rows, next_start = next(iter_view_pages(self.view_name, self.per_page, cursor=start, **self.params))
+
+        if self.model is not None:
+            object_list = load_objects([x.docid for x in rows], self.model)
+        else:
+            object_list = rows
+
+        return Page(object_list, cursor or None, encode_cursor(next_start, self.salt), self)
+
+    def previous_cursor(self, cursor):
+        """
+        Returns the cursor of the page before the one starting at ``cursor``,
+        the rows before it are read in the reverse order.
+        """
+        start = decode_cursor(cursor, self.salt)
+        if start is None:
+            return None
+
+        params = key_range(self.params)
+        params['startkey'], params['endkey'] = params.get('endkey'), params.get('startkey')
+        params = dict((k, v) for k, v in params.items() if v is not None)
+        params['descending'] = not params.get('descending', False)
+
+        # the row of the cursor and one more to know if the previous page is the first one
+        rows, _ = next(iter_view_pages(self.view_name, self.per_page + 2, cursor=start, **params))
+        rows = [x for x in rows if (x.key, x.docid) != start]
+        if not rows:
+            return None
+        if len(rows) <= self.per_page:
+            return ''
+        row = rows[self.per_page - 1]
+        return encode_cursor((row.key, row.docid), self.salt)
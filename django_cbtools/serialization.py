@@ -0,0 +1,342 @@
+"""
+Conversion of models to Sync-Gateway documents and back.
+
+Every model class gets an encoder compiled once from its ``_meta``,
+it produces exactly the same document as ``model_to_dict`` followed by
+tastypie serializer round trip, but in one pass over the fields.
+A decoder is compiled the same way, it knows in advance which fields
+need datetime / decimal parsing.
+"""
+import importlib
+import json
+import logging
+from collections import namedtuple
+from datetime import datetime
+from decimal import Decimal
+from itertools import chain
+
+from six import text_type, integer_types
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models.fields import DateTimeField, DecimalField
+from django.forms.models import model_to_dict
+from django.utils import dateparse
+
+from tastypie.serializers import Serializer
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_JSON_BACKEND = 'json'
+
+# values of these types are the same after the tastypie round trip
+PLAIN_TYPES = frozenset((text_type, bool, float, type(None)) + tuple(integer_types))
+
+_serializer = Serializer()
+_json_backend = None
+_json_backend_name = None
+_encoders = {}
+_decoders = {}
+_values_decoders = {}
+
+# python 3.7+, much faster than the regular expression of ``parse_datetime``
+_fromisoformat = getattr(datetime, 'fromisoformat', None)
+
+
+def get_json_backend():
+    """
+    Returns module used to encode / decode Sync-Gateway documents, it's set
+    by ``CBTOOLS_JSON_BACKEND`` setting. The module must have ``dumps``
+    and ``loads`` functions (``json``, ``simplejson``, ``ujson``, ``orjson``, ...).
+    """
+    global _json_backend, _json_backend_name
+    name = getattr(settings, 'CBTOOLS_JSON_BACKEND', DEFAULT_JSON_BACKEND)
+    if _json_backend is None or _json_backend_name != name:
+        _json_backend = importlib.import_module(name)
+        _json_backend_name = name
+    return _json_backend
+
+
+def dumps(data):
+    return get_json_backend().dumps(data)
+
+
+def loads(content):
+    return get_json_backend().loads(content)
+
+
+def simplify(value):
+    """
+    Converts ``value`` the same way tastypie serializer + json round trip does.
+    """
+    value_type = type(value)
+    if value_type in PLAIN_TYPES:
+        return value
+    if value_type is Decimal:
+        return text_type(value)
+
+    simple = _serializer.to_simple(value, {})
+    return json.loads(json.dumps(simple, cls=DjangoJSONEncoder, sort_keys=True))
+
+
+def isoformat_or_none(value):
+    try:
+        return value.isoformat()
+    except Exception:
+        return None
+
+
+class ModelEncoder(object):
+    """
+    Encodes instances of one model class to Sync-Gateway documents.
+    """
+
+    def __init__(self, model_class, nested=False):
+        from django_cbtools.models import CouchbaseModel, DOC_TYPE_FIELD_NAME, CHANNELS_FIELD_NAME
+
+        opts = model_class._meta
+        self.nested = nested
+        # respect the date format overridden by a model
+        self.custom_date = (not nested and
+                            model_class._string_from_date != CouchbaseModel._string_from_date)
+        self.doc_type_name = DOC_TYPE_FIELD_NAME
+        self.channels_name = CHANNELS_FIELD_NAME
+
+        # the same fields ``model_to_dict`` takes, sorted as tastypie does
+        fields = [f for f in chain(opts.concrete_fields, opts.private_fields, opts.many_to_many)
+                  if getattr(f, 'editable', False)]
+        fields.sort(key=lambda f: f.name)
+
+        datetime_names = set()
+        self.extra_datetime_names = []
+        if not nested:
+            # documents store datetimes with ``isoformat()``, timezone included
+            for field in opts.fields:
+                if isinstance(field, DateTimeField):
+                    datetime_names.add(field.name)
+                    if field not in fields:
+                        self.extra_datetime_names.append(field.name)
+
+        self.plan = [(f.name, f, f.name in datetime_names) for f in fields]
+
+    def encode(self, obj):
+        d = {}
+        for name, field, is_datetime in self.plan:
+            value = field.value_from_object(obj)
+            if is_datetime:
+                d[name] = obj._string_from_date(name) if self.custom_date else isoformat_or_none(value)
+            elif type(value) in PLAIN_TYPES:
+                d[name] = value
+            else:
+                d[name] = simplify(value)
+
+        if self.nested:
+            d['uid'] = obj.get_uid()
+            return d
+
+        d[self.doc_type_name] = obj.get_doc_type()
+        d[self.channels_name] = obj.channels
+
+        for name in self.extra_datetime_names:
+            if self.custom_date:
+                d[name] = obj._string_from_date(name)
+            else:
+                d[name] = isoformat_or_none(getattr(obj, name, None))
+
+        return d
+
+
+def get_encoder(model_class, nested=False):
+    key = (model_class, nested)
+    encoder = _encoders.get(key)
+    if encoder is None:
+        encoder = _encoders[key] = ModelEncoder(model_class, nested)
+    return encoder
+
+
+def legacy_to_dict(obj, nested=False):
+    """
+    The conversion used before compiled encoders, kept to compare
+    the results and the speed.
+    """
+    from django_cbtools.models import DOC_TYPE_FIELD_NAME, CHANNELS_FIELD_NAME
+
+    d = model_to_dict(obj)
+    tastyjson = obj._serializer.to_json(d)
+    d = obj._serializer.from_json(tastyjson)
+
+    if nested:
+        d['uid'] = obj.get_uid()
+        return d
+
+    d[DOC_TYPE_FIELD_NAME] = obj.get_doc_type()
+    d[CHANNELS_FIELD_NAME] = obj.channels
+
+    for field in obj._meta.fields:
+        if isinstance(field, DateTimeField):
+            d[field.name] = obj._string_from_date(field.name)
+
+    return d
+
+
+def parse_datetime(field_name, value):
+    if value is None:
+        return None
+
+    # fast path for the values written by ``isoformat()``
+    if (_fromisoformat is not None and type(value) is text_type and len(value) >= 19 and
+            value[4] == '-' and value[7] == '-' and value[10] in 'T '):
+        try:
+            return _fromisoformat(value)
+        except ValueError:
+            pass
+
+    try:
+        return dateparse.parse_datetime(value)
+    except Exception as e:
+        logger.warning('can not parse date (raw value used) %s: %s', field_name, e)
+        return value
+
+
+def parse_decimal(field_name, value):
+    if value is None:
+        return None
+
+    try:
+        return Decimal(value)
+    except Exception as e:
+        logger.warning('can not parse decimal (raw value used) %s: %s', field_name, e)
+        return value
+
+
+class ModelDecoder(object):
+    """
+    Sets attributes of model instances from Sync-Gateway documents.
+    """
+
+    def __init__(self, model_class):
+        from django_cbtools.models import CouchbaseModel, CHANNELS_FIELD_NAME
+
+        self.channels_name = CHANNELS_FIELD_NAME
+
+        # respect the parsers overridden by a model
+        custom_date = model_class._date_from_string != CouchbaseModel._date_from_string
+        custom_decimal = model_class._decimal_from_string != CouchbaseModel._decimal_from_string
+
+        self.plan = []
+        for field in model_class._meta.fields:
+            if isinstance(field, DateTimeField):
+                parse, method = parse_datetime, '_date_from_string' if custom_date else None
+            elif isinstance(field, DecimalField):
+                parse, method = parse_decimal, '_decimal_from_string' if custom_decimal else None
+            else:
+                parse, method = None, None
+            self.plan.append((field.name, parse, method))
+
+    def decode(self, obj, dict_payload):
+        for name, parse, method in self.plan:
+            if name not in dict_payload:
+                continue
+            value = dict_payload[name]
+            if method is not None:
+                getattr(obj, method)(name, value)
+            elif parse is not None:
+                setattr(obj, name, parse(name, value))
+            else:
+                setattr(obj, name, value)
+
+        if self.channels_name in dict_payload:
+            obj.channels = dict_payload[self.channels_name]
+
+
+def get_decoder(model_class):
+    decoder = _decoders.get(model_class)
+    if decoder is None:
+        decoder = _decoders[model_class] = ModelDecoder(model_class)
+    return decoder
+
+
+def legacy_from_dict(obj, dict_payload):
+    """
+    The conversion used before compiled decoders, kept to compare
+    the results and the speed.
+    """
+    from django_cbtools.models import CHANNELS_FIELD_NAME
+
+    for field in obj._meta.fields:
+        if field.name not in dict_payload:
+            continue
+        if isinstance(field, DateTimeField):
+            obj._date_from_string(field.name, dict_payload.get(field.name))
+        elif isinstance(field, DecimalField):
+            obj._decimal_from_string(field.name, dict_payload.get(field.name))
+        elif field.name in dict_payload:
+            setattr(obj, field.name, dict_payload[field.name])
+
+    if CHANNELS_FIELD_NAME in dict_payload.keys():
+        obj.channels = dict_payload[CHANNELS_FIELD_NAME]
+
+
+class ValuesDecoder(object):
+    """
+    Decodes Sync-Gateway rows to dictionaries or named tuples with ``uid``
+    and the requested ``fields`` only (all the model fields and ``channels``
+    by default), ``rev`` and ``channels`` can be requested too. Only the
+    requested datetime / decimal fields are parsed.
+    """
+
+    def __init__(self, model_class, fields=None):
+        from django_cbtools.models import CHANNELS_FIELD_NAME
+
+        opts = model_class._meta
+        if fields is None:
+            fields = [f.name for f in opts.fields] + [CHANNELS_FIELD_NAME]
+
+        self.plan = []
+        for name in fields:
+            if name == 'rev':
+                self.plan.append((name, None, None))
+                continue
+            if name == CHANNELS_FIELD_NAME:
+                self.plan.append((name, None, list))
+                continue
+
+            field = opts.get_field(name)
+            if isinstance(field, DateTimeField):
+                parse = parse_datetime
+            elif isinstance(field, DecimalField):
+                parse = parse_decimal
+            else:
+                parse = None
+            self.plan.append((name, parse, field.get_default))
+
+        self.names = ['uid'] + [name for name, parse, default in self.plan]
+        self.row_class = namedtuple('%sRow' % model_class.__name__, self.names)
+
+    def values(self, row):
+        doc = row['doc']
+        values = [row['id']]
+        for name, parse, default in self.plan:
+            if default is None:
+                # ``rev`` is not in the document
+                values.append(row['value']['rev'])
+            elif name in doc:
+                value = doc[name]
+                values.append(parse(name, value) if parse is not None else value)
+            else:
+                values.append(default())
+        return values
+
+    def decode_dict(self, row):
+        return dict(zip(self.names, self.values(row)))
+
+    def decode_row(self, row):
+        return self.row_class(*self.values(row))
+
+
+def get_values_decoder(model_class, fields=None):
+    key = (model_class, tuple(fields) if fields is not None else None)
+    decoder = _values_decoders.get(key)
+    if decoder is None:
+        decoder = _values_decoders[key] = ValuesDecoder(model_class, fields)
+    return decoder
@@ -1,3 +1,4 @@
+from django.dispatch import Signal
 from django.db.models.signals import ModelSignal
 
 cb_pre_save = ModelSignal(providing_args=["instance"], use_caching=True)
@@ -5,3 +6,6 @@ cb_post_save = ModelSignal(providing_args=["instance", "created"], use_caching=T
 
 cb_pre_delete = ModelSignal(providing_args=["instance"], use_caching=True)
 cb_post_delete = ModelSignal(providing_args=["instance"], use_caching=True)
+
+# sent by ``ChangesConsumer``, ``sender`` is the ``doc_type`` of changed documents
+cb_changes = Signal(providing_args=["doc_type", "changes"])
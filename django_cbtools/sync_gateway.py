@@ -1,12 +1,32 @@
+import codecs
 import json
 import logging
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock, local
+
 import requests
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
+from six.moves import http_cookiejar
 
 from django.conf import settings
 
+from django_cbtools import cache, serialization
+
 logger = logging.getLogger(__name__)
 
+DEFAULT_POOL_CONNECTIONS = 10
+DEFAULT_POOL_MAXSIZE = 10
+DEFAULT_BULK_CHUNK_SIZE = 500
+DEFAULT_ALL_DOCS_CHUNK_SIZE = 1000
+DEFAULT_ALL_DOCS_WORKERS = 4
+DEFAULT_SCAN_PAGE_SIZE = 1000
+STREAM_CHUNK_SIZE = 64 * 1024
+
+ROWS_START_RE = re.compile(r'"rows"\s*:\s*\[')
+
 
 class SyncGatewayException(Exception):
     pass
@@ -16,15 +36,205 @@ class SyncGatewayConflict(SyncGatewayException):
     pass
 
 
+class SyncGatewayBulkError(SyncGatewayException):
+    """
+    Raised by bulk operations when some of the documents were not saved.
+    ``errors`` is a list of dictionaries with ``document``, ``id``,
+    ``status``, ``error`` and ``reason`` keys.
+    """
+
+    def __init__(self, message, errors):
+        super(SyncGatewayBulkError, self).__init__(message)
+        self.errors = errors
+
+    @property
+    def conflicts(self):
+        return [x for x in self.errors if x['status'] == 409]
+
+
+def chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def iter_json_rows(data_chunks):
+    """
+    Yields rows of ``{"rows": [...], ...}`` JSON document one by one,
+    decoding them as soon as they arrive. ``data_chunks`` is an iterable
+    of UTF-8 encoded pieces of the document, so only one row and one chunk
+    are kept in memory at a time.
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    data_chunks = iter(data_chunks)
+    buf = ''
+    pos = None
+
+    def read_more():
+        for data in data_chunks:
+            if data:
+                return text_decoder.decode(data)
+        return None
+
+    while pos is None:
+        more = read_more()
+        if more is None:
+            raise SyncGatewayException("No rows in the response")
+        buf += more
+        match = ROWS_START_RE.search(buf)
+        if match:
+            pos = match.end()
+
+    while True:
+        # skip separators between rows
+        while pos < len(buf) and buf[pos] in ' \t\r\n,':
+            pos += 1
+
+        if pos < len(buf) and buf[pos] == ']':
+            return
+
+        try:
+            if pos >= len(buf):
+                raise ValueError('need more data')
+            row, end = decoder.raw_decode(buf, pos)
+        except ValueError:
+            more = read_more()
+            if more is None:
+                raise SyncGatewayException("Unexpected end of the rows response")
+            buf = buf[pos:] + more
+            pos = 0
+            continue
+
+        yield row
+        pos = end
+
+
+class SessionPool(object):
+    """
+    Keeps one ``requests.Session`` per thread. All the sessions share
+    the same ``HTTPAdapter``, so keep-alive connections to Sync-Gateway
+    are reused across calls and threads instead of doing a TCP / TLS
+    handshake for every request.
+
+    The adapter is recreated after ``fork()``, so workers never share
+    sockets with their parent process.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._local = local()
+        self._adapter = None
+        self._pid = None
+
+    def get_adapter(self):
+        with self._lock:
+            if self._adapter is None or self._pid != os.getpid():
+                self._adapter = HTTPAdapter(
+                    pool_connections=getattr(settings, 'SYNC_GATEWAY_POOL_CONNECTIONS', DEFAULT_POOL_CONNECTIONS),
+                    pool_maxsize=getattr(settings, 'SYNC_GATEWAY_POOL_MAXSIZE', DEFAULT_POOL_MAXSIZE),
+                    pool_block=getattr(settings, 'SYNC_GATEWAY_POOL_BLOCK', False),
+                    max_retries=getattr(settings, 'SYNC_GATEWAY_MAX_RETRIES', 0))
+                self._pid = os.getpid()
+            return self._adapter
+
+    def session(self):
+        adapter = self.get_adapter()
+        session = getattr(self._local, 'session', None)
+
+        if session is None or self._local.adapter is not adapter:
+            session = requests.Session()
+            session.verify = False
+            # we authenticate every request explicitly, a cookie set by
+            # ``_session`` must never be sent with the admin credentials
+            session.cookies.set_policy(http_cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+
+            if not getattr(settings, 'SYNC_GATEWAY_KEEP_ALIVE', True):
+                session.headers['Connection'] = 'close'
+
+            self._local.session = session
+            self._local.adapter = adapter
+
+        return session
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', getattr(settings, 'SYNC_GATEWAY_TIMEOUT', None))
+        return self.session().request(method, url, **kwargs)
+
+    def stats(self):
+        """
+        Returns list of dictionaries, one per connection pool (host).
+        """
+        if self._adapter is None:
+            return []
+
+        pools = self._adapter.poolmanager.pools
+        result = []
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            result.append(dict(scheme=pool.scheme,
+                               host=pool.host,
+                               port=pool.port,
+                               maxsize=pool.pool.maxsize if pool.pool else 0,
+                               idle_connections=pool.pool.qsize() if pool.pool else 0,
+                               num_connections=pool.num_connections,
+                               num_requests=pool.num_requests))
+        return result
+
+    def reset(self):
+        with self._lock:
+            if self._adapter is not None and self._pid == os.getpid():
+                self._adapter.close()
+            self._adapter = None
+            self._pid = None
+
+
+session_pool = SessionPool()
+
+_executor = None
+_executor_pid = None
+_executor_lock = Lock()
+
+
+def get_executor():
+    """
+    Returns thread pool used to run Sync-Gateway requests concurrently.
+    The size is limited by ``SYNC_GATEWAY_ALL_DOCS_WORKERS``.
+    """
+    global _executor, _executor_pid
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(getattr(settings, 'SYNC_GATEWAY_ALL_DOCS_WORKERS',
+                                                   DEFAULT_ALL_DOCS_WORKERS))
+            _executor_pid = os.getpid()
+        return _executor
+
+
 class SyncGateway(object):
+    _auth = None
+
     @staticmethod
     def put_user(username, email=None, password=None, admin_channels=None, disabled=False):
-        from .models import CHANNEL_PUBLIC
-
         url = '%s/%s/_user/%s' % (settings.SYNC_GATEWAY_ADMIN_URL,
                                   settings.SYNC_GATEWAY_BUCKET,
                                   username)
 
+        dict_payload = SyncGateway._user_payload(email, password, admin_channels, disabled)
+
+        json_payload = json.dumps(dict_payload)
+        response = session_pool.request('put', url, data=json_payload)
+        if response.status_code not in [200, 201]:
+            raise SyncGatewayException("Can not create / update sg-user, response code: %d" % response.status_code)
+
+        return True
+
+    @staticmethod
+    def _user_payload(email, password, admin_channels, disabled):
+        from .models import CHANNEL_PUBLIC
+
         if admin_channels is None:
             admin_channels = []
 
@@ -39,12 +249,7 @@ class SyncGateway(object):
         if password is not None:
             dict_payload['password'] = password
 
-        json_payload = json.dumps(dict_payload)
-        response = requests.put(url, data=json_payload, verify=False)
-        if response.status_code not in [200, 201]:
-            raise SyncGatewayException("Can not create / update sg-user, response code: %d" % response.status_code)
-
-        return True
+        return dict_payload
 
     @staticmethod
     def get_user(username):
@@ -52,7 +257,7 @@ class SyncGateway(object):
                                   settings.SYNC_GATEWAY_BUCKET,
                                   username)
 
-        response = requests.get(url, verify=False)
+        response = session_pool.request('get', url)
         if response.status_code not in [200, 201]:
             raise SyncGatewayException("Can not get user (%s), response code: %d" % (username, response.status_code))
 
@@ -63,7 +268,7 @@ class SyncGateway(object):
         url = '%s/%s/_user/' % (settings.SYNC_GATEWAY_ADMIN_URL,
                                 settings.SYNC_GATEWAY_BUCKET)
 
-        response = requests.get(url, verify=False)
+        response = session_pool.request('get', url)
         if response.status_code not in [200, 201]:
             raise SyncGatewayException("Can not get users, response code: %d" % response.status_code)
 
@@ -94,7 +299,7 @@ class SyncGateway(object):
             dict_payload['ttl'] = ttl
 
         json_payload = json.dumps(dict_payload)
-        response = requests.post(url, data=json_payload, verify=False)
+        response = session_pool.request('post', url, data=json_payload)
 
         if response.status_code != 200:
             message = "Can not create session for sg-user (%s), response code: %d" % (username, response.status_code)
@@ -107,7 +312,7 @@ class SyncGateway(object):
                                   settings.SYNC_GATEWAY_BUCKET,
                                   username)
 
-        response = requests.delete(url, verify=False)
+        response = session_pool.request('delete', url)
         if response.status_code not in [200, 201]:
             raise SyncGatewayException("Can not delete user, response code: %d" % response.status_code)
 
@@ -151,36 +356,167 @@ class SyncGateway(object):
         """
         Saves dictinary `data_dict` to database via SyncGateway
         """
-        json_payload = json.dumps(data_dict)
+        json_payload = serialization.dumps(data_dict)
         url = '%s/%s/%s' % (settings.SYNC_GATEWAY_URL,
                             settings.SYNC_GATEWAY_BUCKET,
                             uid)
 
-        return requests.put(url, data=json_payload, auth=SyncGateway.get_auth(), verify=False)
+        response = session_pool.request('put', url, data=json_payload, auth=SyncGateway.get_auth())
+
+        if cache.get_cache() is not None:
+            if response.status_code in [200, 201]:
+                cache.saved(uid, response.json()['rev'], data_dict)
+            else:
+                cache.invalidate(uid)
+
+        return response
 
     @staticmethod
     def save_document(document):
+        data_dict = SyncGateway._document_payload(document)
+
+        response = SyncGateway.save_json(document.get_uid(), data_dict)
+
+        if response.status_code not in [200, 201]:
+            raise SyncGateway._save_error(document, response.status_code)
+
+        d = response.json()
+
+        document.rev = d['rev']
+
+    @staticmethod
+    def _document_payload(document):
         data_dict = document.to_dict()
         if hasattr(document, 'rev') and document.rev:
             data_dict['_rev'] = document.rev
+        return data_dict
 
-        response = SyncGateway.save_json(document.get_uid(), data_dict)
+    @staticmethod
+    def _save_error(document, status_code):
+        rev = document.rev if hasattr(document, 'rev') else 'n/a'
+        logger.error('error on doc saving, status {}, revision {}, uid {}'.format(
+                     status_code, rev, document.get_uid()))
+
+        msg = "Can not save document %s, response code: %d" % (document, status_code)
+
+        if status_code == 409:
+            return SyncGatewayConflict(msg)
+
+        return SyncGatewayException(msg)
+
+    @staticmethod
+    def bulk_docs(docs):
+        """
+        Sends list of dictionaries ``docs`` to ``_bulk_docs``.
+        Returns list of results in the same order.
+        """
+        url = '%s/%s/_bulk_docs' % (settings.SYNC_GATEWAY_URL,
+                                    settings.SYNC_GATEWAY_BUCKET)
+
+        json_payload = serialization.dumps(dict(docs=docs))
+        response = session_pool.request('post', url, data=json_payload,
+                                        auth=SyncGateway.get_auth())
 
         if response.status_code not in [200, 201]:
-            rev = document.rev if hasattr(document, 'rev') else 'n/a'
-            logger.error('error on doc saving, status {}, revision {}, uid {}'.format(
-                         response.status_code, rev, document.get_uid()))
+            raise SyncGatewayException("Can not save documents in bulk, response code: %d" % response.status_code)
 
-            msg = "Can not save document %s, response code: %d" % (document, response.status_code)
+        return serialization.loads(response.content)
 
-            if response.status_code == 409:
-                raise SyncGatewayConflict(msg)
+    @staticmethod
+    def bulk_save(documents, chunk_size=None):
+        """
+        Saves ``documents`` using ``_bulk_docs``, ``chunk_size`` documents
+        per request. Every saved document gets its new ``rev``.
+        Raises ``SyncGatewayBulkError`` with the failed documents
+        after all the chunks are sent. When a request fails after some
+        chunks were written, the documents of that chunk and of the
+        following ones are listed as not sent.
+        """
+        documents = list(documents)
+        chunk_size = chunk_size or getattr(settings, 'SYNC_GATEWAY_BULK_CHUNK_SIZE', DEFAULT_BULK_CHUNK_SIZE)
+        errors = []
+
+        for i, chunk in enumerate(chunks(documents, chunk_size)):
+            try:
+                results = SyncGateway.bulk_docs(SyncGateway._bulk_payload(chunk))
+            except SyncGatewayException as e:
+                if i == 0:
+                    raise
+                errors.extend(SyncGateway._unsent_errors(documents[i * chunk_size:], e))
+                break
+            SyncGateway._bulk_results(chunk, results, errors)
+
+        if errors:
+            raise SyncGatewayBulkError("Can not save %d of %d documents" % (len(errors), len(documents)), errors)
 
-            raise SyncGatewayException(msg)
+    @staticmethod
+    def _unsent_errors(documents, error):
+        return [dict(document=document,
+                     id=document.get_uid(),
+                     status=None,
+                     error='not_sent',
+                     reason=str(error)) for document in documents]
 
-        d = response.json()
+    @staticmethod
+    def _bulk_payload(documents):
+        docs = []
+        for document in documents:
+            data_dict = SyncGateway._document_payload(document)
+            data_dict['_id'] = document.get_uid()
+            docs.append(data_dict)
+        return docs
 
-        document.rev = d['rev']
+    @staticmethod
+    def _bulk_results(documents, results, errors):
+        """
+        Sets new revisions of saved ``documents``, appends failures to ``errors``.
+        """
+        revs = []
+        for document, result in zip(documents, results):
+            if 'error' in result or 'rev' not in result:
+                status = result.get('status') or (409 if result.get('error') == 'conflict' else 500)
+                logger.error('error on doc bulk saving, status {}, uid {}'.format(status, document.get_uid()))
+                errors.append(dict(document=document,
+                                   id=document.get_uid(),
+                                   status=status,
+                                   error=result.get('error'),
+                                   reason=result.get('reason')))
+                revs.append((document.get_uid(), None))
+                continue
+
+            document.rev = result['rev']
+            revs.append((document.get_uid(), document.rev))
+
+        cache.invalidate_many(revs)
+
+    @staticmethod
+    def bulk_delete(revs, chunk_size=None):
+        """
+        Deletes documents using ``_bulk_docs``, ``revs`` is a list of
+        ``(uid, rev)`` tuples. Raises ``SyncGatewayBulkError`` with the
+        documents which were not deleted.
+        """
+        revs = list(revs)
+        chunk_size = chunk_size or getattr(settings, 'SYNC_GATEWAY_BULK_CHUNK_SIZE', DEFAULT_BULK_CHUNK_SIZE)
+        errors = []
+
+        for chunk in chunks(revs, chunk_size):
+            docs = [dict(_id=uid, _rev=rev, _deleted=True) for uid, rev in chunk]
+            results = SyncGateway.bulk_docs(docs)
+
+            cache.invalidate_many([(uid, None) for uid, rev in chunk])
+
+            for (uid, rev), result in zip(chunk, results):
+                if 'error' in result:
+                    status = result.get('status') or (409 if result.get('error') == 'conflict' else 500)
+                    errors.append(dict(document=None,
+                                       id=uid,
+                                       status=status,
+                                       error=result.get('error'),
+                                       reason=result.get('reason')))
+
+        if errors:
+            raise SyncGatewayBulkError("Can not delete %d of %d documents" % (len(errors), len(revs)), errors)
 
     @staticmethod
     def delete_document(uid, rev):
@@ -188,28 +524,241 @@ class SyncGateway(object):
                                    settings.SYNC_GATEWAY_BUCKET,
                                    uid, rev)
 
-        response = requests.delete(url, auth=SyncGateway.get_auth(), verify=False)
+        response = session_pool.request('delete', url, auth=SyncGateway.get_auth())
+        cache.invalidate(uid)
 
         if response.status_code not in [200, 201]:
             raise SyncGatewayException("Can not delete document %s, response code: %d" % (uid, response.status_code))
 
     @staticmethod
-    def all_docs(uids, really_all=False):
+    def all_docs(uids, really_all=False, include_docs=True):
+        """
+        Loads documents with given ``uids``. Long lists of uids are split
+        in chunks of ``SYNC_GATEWAY_ALL_DOCS_CHUNK_SIZE`` keys, the chunks
+        are loaded concurrently and the rows are returned in the order of ``uids``.
+
+        ``really_all`` loads the whole database with one request,
+        use ``scan`` for big databases. Without ``include_docs`` rows
+        contain ``id`` and ``rev`` only.
+
+        Documents enabled by ``CBTOOLS_CACHE_DOC_TYPES`` are taken
+        from the cache when they are there. With ``CBTOOLS_KV_READS``
+        the documents are read from the Couchbase bucket directly.
+        """
         if not uids and not really_all:
             return {"rows": []}
 
+        if not uids:
+            return SyncGateway._all_docs(None, include_docs)
+
+        uids = list(uids)
+        document_cache = cache.get_cache() if include_docs else None
+        if document_cache is None:
+            return SyncGateway._load_all_docs(uids, include_docs)
+
+        cached = document_cache.get_many(uids)
+        missing = [uid for uid in uids if uid not in cached]
+        if not missing:
+            return {"rows": [cached[uid] for uid in uids]}
+
+        try:
+            d = SyncGateway._load_all_docs(missing, include_docs)
+            document_cache.set_many(d['rows'])
+        finally:
+            document_cache.release(missing)
+
+        loaded = iter(d['rows'])
+        return dict(d, rows=[cached[uid] if uid in cached else next(loaded) for uid in uids])
+
+    @staticmethod
+    def _load_all_docs(uids, include_docs):
+        if getattr(settings, 'CBTOOLS_KV_READS', False):
+            from django_cbtools import kv
+            return kv.all_docs(uids, include_docs)
+
+        chunk_size = getattr(settings, 'SYNC_GATEWAY_ALL_DOCS_CHUNK_SIZE', DEFAULT_ALL_DOCS_CHUNK_SIZE)
+        if len(uids) <= chunk_size:
+            return SyncGateway._all_docs(uids, include_docs)
+
+        parts = list(chunks(uids, chunk_size))
+        # the first chunk is loaded by the calling thread
+        futures = [get_executor().submit(SyncGateway._all_docs, part, include_docs) for part in parts[1:]]
+        results = [SyncGateway._all_docs(parts[0], include_docs)] + [f.result() for f in futures]
+
+        rows = []
+        for result in results:
+            rows.extend(result['rows'])
+
+        return dict(results[0], rows=rows)
+
+    @staticmethod
+    def iter_all_docs(uids):
+        """
+        Same as ``all_docs`` but yields rows one by one, decoding them from
+        the response stream. Chunks of keys are requested one after another,
+        so memory usage doesn't depend on the number of ``uids``.
+        """
         url = '%s/%s/_all_docs?include_docs=true' % (settings.SYNC_GATEWAY_URL,
                                                      settings.SYNC_GATEWAY_BUCKET)
 
-        json_data = json.dumps(dict(keys=uids)) if uids else None
-        response = requests.post(url, data=json_data,
-                                 auth=SyncGateway.get_auth(),
-                                 verify=False)
+        uids = list(uids or [])
+        chunk_size = getattr(settings, 'SYNC_GATEWAY_ALL_DOCS_CHUNK_SIZE', DEFAULT_ALL_DOCS_CHUNK_SIZE)
+
+        for part in chunks(uids, chunk_size):
+            response = session_pool.request('post', url, data=json.dumps(dict(keys=part)),
+                                            auth=SyncGateway.get_auth(), stream=True)
+            try:
+                if response.status_code != 200:
+                    raise SyncGatewayException("Can not load documents, response code: %d" % response.status_code)
+
+                for row in iter_json_rows(response.iter_content(STREAM_CHUNK_SIZE)):
+                    yield row
+            finally:
+                response.close()
+
+    @staticmethod
+    def scan_pages(startkey=None, page_size=None, doc_type=None, keys_only=False):
+        """
+        Pages through the whole database ordered by document id.
+        Yields tuples ``(rows, cursor)``, ``cursor`` is the id the next page
+        starts with (``None`` for the last page). Pass it as ``startkey``
+        to resume an interrupted scan.
+
+        ``doc_type`` keeps only documents of given type (so pages can be shorter
+        than ``page_size``), ``keys_only`` skips document bodies, rows contain
+        ``id`` and ``rev`` only.
+        """
+        if keys_only and doc_type:
+            raise ValueError("doc_type filter needs document bodies, it can't be used with keys_only")
+
+        url = '%s/%s/_all_docs' % (settings.SYNC_GATEWAY_URL,
+                                   settings.SYNC_GATEWAY_BUCKET)
+        page_size = page_size or getattr(settings, 'SYNC_GATEWAY_SCAN_PAGE_SIZE', DEFAULT_SCAN_PAGE_SIZE)
+
+        while True:
+            # one extra row tells where the next page starts
+            params = dict(limit=page_size + 1,
+                          include_docs='false' if keys_only else 'true')
+            if startkey is not None:
+                params['startkey'] = json.dumps(startkey)
+
+            response = session_pool.request('get', url, params=params, auth=SyncGateway.get_auth())
+            if response.status_code != 200:
+                raise SyncGatewayException("Can not scan documents, response code: %d" % response.status_code)
+
+            rows = response.json()['rows']
+            cursor = rows[page_size]['id'] if len(rows) > page_size else None
+            rows = rows[:page_size]
+
+            if doc_type is not None:
+                # removed documents have ``"doc": null``
+                rows = [x for x in rows if (x.get('doc') or {}).get('doc_type') == doc_type]
+
+            yield rows, cursor
+
+            if cursor is None:
+                return
+            startkey = cursor
+
+    @staticmethod
+    def scan(startkey=None, page_size=None, doc_type=None, keys_only=False):
+        """
+        Yields all the rows of the database page by page, see ``scan_pages``.
+        """
+        for rows, cursor in SyncGateway.scan_pages(startkey, page_size, doc_type, keys_only):
+            for row in rows:
+                yield row
+
+    @staticmethod
+    def changes(since=None, feed='longpoll', limit=None, include_docs=False, timeout=None):
+        """
+        Returns one batch of the ``_changes`` feed: ``{"results": [...], "last_seq": ...}``.
+        ``timeout`` (milliseconds) is how long a ``longpoll`` request waits for changes.
+        """
+        url = '%s/%s/_changes' % (settings.SYNC_GATEWAY_URL,
+                                  settings.SYNC_GATEWAY_BUCKET)
+
+        params = dict(feed=feed, include_docs='true' if include_docs else 'false')
+        if since is not None:
+            params['since'] = since
+        if limit is not None:
+            params['limit'] = limit
+        if timeout is not None:
+            params['timeout'] = timeout
+
+        kwargs = {}
+        if timeout is not None:
+            # sync gateway answers after ``timeout`` ms, wait for it a bit longer
+            kwargs['timeout'] = timeout / 1000.0 + 30
+
+        response = session_pool.request('get', url, params=params, auth=SyncGateway.get_auth(), **kwargs)
+        if response.status_code != 200:
+            raise SyncGatewayException("Can not get changes, response code: %d" % response.status_code)
 
-        # print response.json()
         return response.json()
 
+    @staticmethod
+    def iter_changes(since=None, include_docs=False, heartbeat=30000):
+        """
+        Yields changes of the ``continuous`` feed as they happen, forever.
+        ``None`` is yielded on every heartbeat (``heartbeat`` milliseconds),
+        so the caller can do its periodic work even if nothing changes.
+        """
+        url = '%s/%s/_changes' % (settings.SYNC_GATEWAY_URL,
+                                  settings.SYNC_GATEWAY_BUCKET)
+
+        params = dict(feed='continuous', heartbeat=heartbeat,
+                      include_docs='true' if include_docs else 'false')
+        if since is not None:
+            params['since'] = since
+
+        response = session_pool.request('get', url, params=params, auth=SyncGateway.get_auth(),
+                                        stream=True, timeout=heartbeat / 1000.0 + 30)
+        try:
+            if response.status_code != 200:
+                raise SyncGatewayException("Can not get changes, response code: %d" % response.status_code)
+
+            # the feed is sent with chunked encoding, every received chunk
+            # is passed on at once, so small lines don't wait for a full buffer
+            for line in response.iter_lines():
+                if not line.strip():
+                    yield None
+                    continue
+                yield json.loads(line.decode('utf-8'))
+        finally:
+            response.close()
+
+    @staticmethod
+    def _all_docs(uids, include_docs=True):
+        url = '%s/%s/_all_docs?include_docs=%s' % (settings.SYNC_GATEWAY_URL,
+                                                   settings.SYNC_GATEWAY_BUCKET,
+                                                   'true' if include_docs else 'false')
+
+        json_data = json.dumps(dict(keys=uids)) if uids else None
+        response = session_pool.request('post', url, data=json_data,
+                                        auth=SyncGateway.get_auth())
+
+        return serialization.loads(response.content)
+
     @staticmethod
     def get_auth():
-        return HTTPBasicAuth(settings.SYNC_GATEWAY_USER,
-                             settings.SYNC_GATEWAY_PASSWORD)
+        auth = SyncGateway._auth
+        if auth is None or (auth.username, auth.password) != (settings.SYNC_GATEWAY_USER,
+                                                              settings.SYNC_GATEWAY_PASSWORD):
+            auth = HTTPBasicAuth(settings.SYNC_GATEWAY_USER,
+                                 settings.SYNC_GATEWAY_PASSWORD)
+            SyncGateway._auth = auth
+        return auth
+
+    @staticmethod
+    def session():
+        return session_pool.session()
+
+    @staticmethod
+    def pool_stats():
+        return session_pool.stats()
+
+    @staticmethod
+    def cache_stats():
+        document_cache = cache.get_cache()
+        return document_cache.stats() if document_cache is not None else None
@@ -1,18 +1,28 @@
 import json
+import sys
+import timeit
 from decimal import Decimal
 from datetime import datetime
+from unittest import skipIf
 from uuid import uuid4
 
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.db import models
 from django.conf import settings
 from django.utils import timezone
 
 from django_cbtools import models as cbm
-from django_cbtools.models import query_objects, load_related_objects, parse_view_name, load_objects
-from django_cbtools.sync_gateway import SyncGateway, SyncGatewayException, SyncGatewayConflict
+from django_cbtools.models import query_objects, load_related_objects, parse_view_name, load_objects, aload_objects
+from django_cbtools.models import iter_objects, iter_view_pages, iter_query_objects
+from django_cbtools.sync_gateway import SyncGateway, SyncGatewayException, SyncGatewayConflict, SyncGatewayBulkError
+from django_cbtools.sync_gateway import iter_json_rows
 from django_cbtools.signals import cb_pre_save, cb_post_save, cb_pre_delete, cb_post_delete
 
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
 class Transaction(cbm.CouchbaseModel):
     class Meta:
         abstract = True
@@ -77,12 +87,10 @@ def clean_buckets():
     if 'test' not in settings.COUCHBASE_BUCKET:
         raise Exception('will not clean non-test bucket')
 
-    all_docs = SyncGateway.all_docs([], really_all=True)
-
-    for i in all_docs['rows']:
+    for i in list(SyncGateway.scan(keys_only=True)):
         uid = i['id']
-        rev = i['value']['rev']
-        if 'sync' in uid:
+        rev = (i.get('value') or {}).get('rev')
+        if 'sync' in uid or rev is None:
             continue
         # print 'del %s' % uid
         SyncGateway.delete_document(uid, rev)
@@ -459,6 +467,11 @@ class CouchbaseModelTestCase(TestCase):
             title = models.CharField(max_length=255)
             author_uid = models.CharField(max_length=255)
 
+        # inherits doc_type, Author is still found by it
+        class Editor(Author):
+            class Meta:
+                abstract = True
+
         channels = ['boo']
 
         au1 = Author(full_name='name1', channels=channels)
@@ -500,6 +513,293 @@ class CouchbaseModelTestCase(TestCase):
         self.assertEqual(articles[3].author.uid, au3.uid)
         self.assertIsNone(articles[4].author)
 
+    def test_prefetch(self):
+        from django_cbtools.models import prefetch, Prefetch
+
+        class Company(cbm.CouchbaseModel):
+            class Meta:
+                abstract = True
+            doc_type = 'pf_company'
+
+            name = models.CharField(max_length=255)
+
+        class Author(cbm.CouchbaseModel):
+            class Meta:
+                abstract = True
+            doc_type = 'pf_author'
+
+            name = models.CharField(max_length=255)
+            company_uid = models.CharField(max_length=255)
+
+        class Tag(cbm.CouchbaseModel):
+            class Meta:
+                abstract = True
+            doc_type = 'pf_tag'
+
+            name = models.CharField(max_length=255)
+
+        class Article(cbm.CouchbaseModel):
+            class Meta:
+                abstract = True
+            doc_type = 'pf_article'
+
+            title = models.CharField(max_length=255)
+            author_uid = models.CharField(max_length=255)
+
+        # inherits doc_type, Author is still found by it
+        class Editor(Author):
+            class Meta:
+                abstract = True
+
+        channels = ['boo']
+
+        company = Company(name='company', channels=channels)
+        company.save()
+        au1 = Author(name='name1', company_uid=company.uid, channels=channels)
+        au1.save()
+        au2 = Author(name='name2', company_uid=company.uid, channels=channels)
+        au2.save()
+        tags = [Tag(name='tag%d' % i, channels=channels) for i in range(3)]
+        Tag.bulk_save(tags)
+
+        articles = []
+        for i, author in enumerate([au1, au2, au1, None]):
+            article = Article(title='title%d' % i, author_uid=author.uid if author else None, channels=channels)
+            for tag in tags[:i]:
+                article.append_to_references_list('tags_uids', tag.uid)
+            articles.append(article)
+        Article.bulk_save(articles)
+
+        articles = load_objects([x.uid for x in articles], Article)
+        prefetch(articles, 'author__company', 'tags_uids')
+
+        self.assertEqual(['name1', 'name2', 'name1'], [x.author.name for x in articles[:3]])
+        self.assertIsNone(articles[3].author)
+        self.assertIs(articles[0].author, articles[2].author)
+        self.assertIs(articles[0].author.company, articles[1].author.company)
+        self.assertEqual('company', articles[0].author.company.name)
+        self.assertEqual([[], ['tag0'], ['tag0', 'tag1'], ['tag0', 'tag1', 'tag2']],
+                         [[t.name for t in x.tags] for x in articles])
+
+        prefetch(articles, Prefetch('author', Author))
+        self.assertEqual('name2', articles[1].author.name)
+
+        # removed documents (rows with "doc": null) are skipped
+        SyncGateway.delete_document(tags[0].uid, tags[0].rev)
+        prefetch(articles, 'tags_uids')
+        self.assertEqual([[], [], ['tag1'], ['tag1', 'tag2']], [[t.name for t in x.tags] for x in articles])
+
+    def test_bulk_save(self):
+        objs = [Mock(title='title %d' % i, channels=['boo']) for i in range(5)]
+        Mock.bulk_save(objs, chunk_size=2)
+
+        for o in objs:
+            self.assertIsNotNone(o.uid)
+            self.assertIsNotNone(o.rev)
+            self.assertIsNotNone(o.created)
+            self.assertEqual(o.created, o.updated)
+
+        loaded = load_objects([o.uid for o in objs], Mock)
+        self.assertEqual([o.title for o in loaded], ['title %d' % i for i in range(5)])
+
+        revs = [o.rev for o in objs]
+        for o in objs:
+            o.title2 = 'updated'
+        Mock.bulk_save(objs)
+        for o, rev in zip(objs, revs):
+            self.assertNotEqual(rev, o.rev)
+        self.assertEqual(Mock(objs[0].uid).title2, 'updated')
+
+    def test_bulk_save_conflict(self):
+        o = Mock(title='title', channels=['boo'])
+        o.save()
+        stale = Mock(o.uid)
+        o.save()
+
+        fresh = Mock(title='fresh', channels=['boo'])
+
+        with self.assertRaises(SyncGatewayBulkError) as cm:
+            Mock.bulk_save([stale, fresh])
+
+        self.assertEqual(len(cm.exception.errors), 1)
+        self.assertEqual(len(cm.exception.conflicts), 1)
+        self.assertIs(cm.exception.conflicts[0]['document'], stale)
+        self.assertIsNotNone(fresh.rev)
+
+    def test_bulk_save_failed_request(self):
+        from django_cbtools import sync_gateway
+
+        objs = [Mock(title='title %d' % i, channels=['boo']) for i in range(4)]
+        bulk_docs = SyncGateway.bulk_docs
+        calls = []
+
+        def failing_bulk_docs(docs):
+            calls.append(docs)
+            if len(calls) > 1:
+                raise SyncGatewayException('down')
+            return bulk_docs(docs)
+
+        sync_gateway.SyncGateway.bulk_docs = staticmethod(failing_bulk_docs)
+        try:
+            with self.assertRaises(SyncGatewayBulkError) as cm:
+                Mock.bulk_save(objs, chunk_size=2)
+        finally:
+            sync_gateway.SyncGateway.bulk_docs = staticmethod(bulk_docs)
+
+        # the first chunk is written, the second one is reported
+        self.assertEqual([objs[2], objs[3]], [x['document'] for x in cm.exception.errors])
+        self.assertEqual(objs[0].rev, Mock(objs[0].uid).rev)
+        self.assertIsNone(objs[2].rev)
+
+    def test_load_objects_chunked(self):
+        objs = [Mock(title='title %d' % i, channels=['boo']) for i in range(7)]
+        Mock.bulk_save(objs)
+        keys = [o.uid for o in reversed(objs)]
+
+        with override_settings(SYNC_GATEWAY_ALL_DOCS_CHUNK_SIZE=2):
+            loaded = load_objects(keys, Mock)
+            self.assertEqual([o.uid for o in loaded], keys)
+
+            d = SyncGateway.all_docs(keys + ['not_existing_key'])
+            self.assertEqual(len(d['rows']), 8)
+            self.assertIn('error', d['rows'][-1])
+
+    def test_batch(self):
+        from django_cbtools.batch import cb_batch
+
+        m = Mock(title='title', channels=['boo'])
+
+        with self.assertRaises(ValueError):
+            with cb_batch():
+                m.save()
+                raise ValueError()
+        self.assertIsNone(m.rev)
+
+        m.save()
+        m1 = Mock(m.uid)
+        m1.save()
+
+        m2 = Mock(title='m2', channels=['boo'])
+        with self.assertRaises(SyncGatewayBulkError) as e:
+            with cb_batch():
+                m.title = 'conflict'
+                m.save()
+                m2.save()
+
+        self.assertEqual([m.uid], [x['id'] for x in e.exception.errors])
+        self.assertEqual(409, e.exception.errors[0]['status'])
+        self.assertEqual('m2', Mock(m2.uid).title)
+
+        # failures of the documents saved by the signal handlers are raised too
+        stale = Mock(m.uid)
+        Mock(m.uid).save()
+
+        def stale_handler(signal, sender, instance, created, **kwargs):
+            if created:
+                stale.save()
+
+        cb_post_save.connect(stale_handler, Mock)
+        try:
+            with self.assertRaises(SyncGatewayBulkError) as e:
+                with cb_batch():
+                    m1.title = 'conflict'
+                    m1.save()
+                    Mock(title='m3', channels=['boo']).save()
+        finally:
+            cb_post_save.disconnect(stale_handler, Mock)
+
+        self.assertEqual([m.uid, m.uid], [x['id'] for x in e.exception.errors])
+        self.assertEqual([m1, stale], [x['document'] for x in e.exception.errors])
+
+    def test_only_if_changed(self):
+        class Tracked(Mock):
+            class Meta:
+                abstract = True
+            track_changes = True
+
+        m = Tracked(title='title', channels=['boo'])
+        self.assertTrue(m.has_changes())
+        m.save()
+        self.assertFalse(m.has_changes())
+
+        rev = m.rev
+        m.save(only_if_changed=True)
+        self.assertEqual(rev, m.rev)
+
+        loaded = Tracked(m.uid)
+        self.assertFalse(loaded.has_changes())
+        loaded.channels.append('foo')
+        self.assertTrue(loaded.has_changes())
+        loaded.save(only_if_changed=True)
+        self.assertNotEqual(rev, loaded.rev)
+
+        objs = [Tracked(m.uid), Tracked(m.uid)]
+        objs[1].title = 'changed'
+        Tracked.bulk_save(objs, only_if_changed=True)
+        self.assertEqual(loaded.rev, objs[0].rev)
+        self.assertNotEqual(loaded.rev, objs[1].rev)
+
+        # without track_changes every document is saved
+        self.assertTrue(Mock(m.uid).has_changes())
+
+    def test_load_objects_values(self):
+        objs = [Transaction(title='title %d' % i, amount=Decimal('1.5'), channels=['boo']) for i in range(3)]
+        Transaction.bulk_save(objs)
+        uids = [o.uid for o in objs]
+
+        values = load_objects(uids + ['not_existing_key'], Transaction, values=True)
+        self.assertEqual(3, len(values))
+        self.assertEqual(uids[0], values[0]['uid'])
+        self.assertEqual('title 0', values[0]['title'])
+        self.assertEqual(Decimal('1.5'), values[0]['amount'])
+        self.assertEqual(objs[0].created, values[0]['created'])
+        self.assertEqual(['boo'], values[0]['channels'])
+
+        rows = load_objects(uids, Transaction, named=True, fields=['title', 'rev'])
+        self.assertEqual(('uid', 'title', 'rev'), rows[1]._fields)
+        self.assertEqual((uids[1], 'title 1', objs[1].rev), tuple(rows[1]))
+
+        values = load_objects(uids, Transaction, fields=['amount'])
+        self.assertEqual({'uid': uids[2], 'amount': Decimal('1.5')}, values[2])
+
+    def test_iter_objects(self):
+        objs = [Mock(title='title %d' % i, channels=['boo']) for i in range(5)]
+        Mock.bulk_save(objs)
+        keys = [o.uid for o in objs] + ['not_existing_key']
+
+        with override_settings(SYNC_GATEWAY_ALL_DOCS_CHUNK_SIZE=2):
+            it = iter_objects(keys, Mock)
+            self.assertEqual(next(it).uid, objs[0].uid)
+            self.assertEqual([o.uid for o in it], [o.uid for o in objs[1:]])
+
+        self.assertEqual(list(iter_objects([], Mock)), [])
+
+    def test_scan(self):
+        objs = [Mock(title='title %d' % i, channels=['boo']) for i in range(5)]
+        objs += [Money(channels=['boo']) for i in range(2)]
+        Mock.bulk_save(objs)
+        uids = sorted(o.uid for o in objs)
+
+        pages = list(SyncGateway.scan_pages(page_size=3))
+        self.assertEqual([len(rows) for rows, cursor in pages], [3, 3, 1])
+        self.assertEqual([x['id'] for rows, cursor in pages for x in rows], uids)
+        self.assertEqual(pages[0][1], uids[3])
+        self.assertIsNone(pages[-1][1])
+
+        # resume from the cursor
+        rows = list(SyncGateway.scan(startkey=pages[0][1], page_size=3))
+        self.assertEqual([x['id'] for x in rows], uids[3:])
+
+        rows = list(SyncGateway.scan(page_size=3, doc_type=Money.doc_type))
+        self.assertEqual(len(rows), 2)
+
+        rows = list(SyncGateway.scan(keys_only=True))
+        self.assertEqual([x['id'] for x in rows], uids)
+        self.assertNotIn('doc', rows[0])
+
+        with self.assertRaises(ValueError):
+            list(SyncGateway.scan(keys_only=True, doc_type=Money.doc_type))
+
     def test_datetime_null_saving(self):
         channels = ['boo']
 
@@ -643,6 +943,136 @@ class SyncGatewayTestCase(TestCase):
         key = [self.channel, Mock.doc_type]
         query_objects('by_channel', key, Mock)
 
+    def test_iter_view_pages(self):
+        m = Mock(title="my title", b=True, num=12)
+        m.channels.append(self.channel)
+        m.save()
+        key = [self.channel, Mock.doc_type]
+
+        pages = list(iter_view_pages('by_channel', 2, key=key))
+        self.assertEqual([len(rows) for rows, cursor in pages], [2, 1])
+        self.assertEqual(sorted(x.docid for rows, cursor in pages for x in rows),
+                         sorted([self.uid1, self.uid2, m.uid]))
+
+        rows, cursor = pages[0]
+        resumed = list(iter_view_pages('by_channel', 2, cursor=cursor, key=key))
+        self.assertEqual(resumed[0][0][0].docid, pages[1][0][0].docid)
+
+    def test_iter_query_objects(self):
+        m = Mock(title="my title", b=True, num=12)
+        m.channels.append(self.channel)
+        m.save()
+        key = [self.channel, Mock.doc_type]
+
+        expected = [x.uid for x in query_objects('by_channel', key, Mock)]
+        self.assertEqual(expected, [x.uid for x in iter_query_objects('by_channel', key, Mock, page_size=2)])
+        self.assertEqual([], list(iter_query_objects('by_channel', ['no channel', Mock.doc_type], Mock)))
+
+    def test_count_view(self):
+        from couchbase.views.params import Query
+        from django_cbtools.models import count_view, query_view, reduce_view
+
+        key = [self.channel, Mock.doc_type]
+        self.assertEqual(2, count_view('by_channel', key, stale=False))
+        self.assertEqual(0, count_view('by_channel', ['no channel', Mock.doc_type], stale=False))
+        self.assertTrue(count_view('by_type', Mock.doc_type, stale=False) >= 2)
+
+        groups = dict((tuple(k), v) for k, v in reduce_view('by_channel', group_level=1, stale=False))
+        self.assertEqual(2, groups[(self.channel,)])
+
+        # the rows of the views with reduce function are queried as usual
+        self.assertEqual(2, len(query_view('by_channel', key)))
+        query = Query(keys=[key], stale=False)
+        self.assertEqual(2, len(query_view('by_channel', None, query=query)))
+
+    def test_keyset_paginator(self):
+        from django_cbtools.pagination import KeysetPaginator, InvalidCursor, decode_cursor, encode_cursor
+
+        m = Mock(title="my title", b=True, num=12)
+        m.channels.append(self.channel)
+        m.save()
+
+        paginator = KeysetPaginator('by_channel', Mock, per_page=2, key=[self.channel, Mock.doc_type])
+        page = paginator.page()
+        self.assertEqual(2, len(page))
+        self.assertTrue(page.has_next())
+        self.assertFalse(page.has_previous())
+
+        last = paginator.page(page.next_cursor)
+        self.assertEqual(1, len(last))
+        self.assertFalse(last.has_next())
+        self.assertEqual(sorted([self.uid1, self.uid2, m.uid]), sorted(x.uid for x in list(page) + list(last)))
+
+        counted = KeysetPaginator('by_channel', Mock, per_page=2, count_view_name='by_channel',
+                                  key=[self.channel, Mock.doc_type], stale=False)
+        self.assertEqual(3, counted.count)
+        self.assertEqual(2, counted.num_pages)
+
+        # only the rows of the pages are counted
+        counted = KeysetPaginator('by_channel', Mock, per_page=2, count_view_name='by_channel',
+                                  startkey=[self.channel, Mock.doc_type], endkey=[self.channel, Mock.doc_type],
+                                  limit=1, stale=False)
+        self.assertEqual(3, counted.count)
+
+        self.assertEqual((['a', 1], 'uid'), decode_cursor(encode_cursor((['a', 1], 'uid'))))
+        with self.assertRaises(InvalidCursor):
+            paginator.page('broken')
+
+        # back to the first page
+        self.assertEqual('', last.previous_cursor)
+        self.assertIsNone(page.previous_cursor)
+        self.assertEqual(page.next_cursor, page.next_page_number())
+        with self.assertRaises(InvalidCursor):
+            last.next_page_number()
+
+    def test_forged_cursor(self):
+        import base64
+        from django_cbtools.pagination import KeysetPaginator, InvalidCursor, encode_cursor
+
+        other = Mock(title='other channel', channels=['other_channel'])
+        other.save()
+        paginator = KeysetPaginator('by_channel', Mock, per_page=2, key=[self.channel, Mock.doc_type])
+        cursor = (['other_channel', Mock.doc_type], other.uid)
+
+        # unsigned cursor reaching out of the key
+        data = json.dumps(list(cursor)).encode('utf-8')
+        with self.assertRaises(InvalidCursor):
+            paginator.page(base64.urlsafe_b64encode(data).decode('ascii'))
+
+        # cursor signed for another paginator
+        another = KeysetPaginator('by_channel', Mock, per_page=2, key=['other_channel', Mock.doc_type])
+        with self.assertRaises(InvalidCursor):
+            paginator.page(encode_cursor(cursor, another.salt))
+
+        # tampered cursor
+        token = encode_cursor(cursor, paginator.salt)
+        with self.assertRaises(InvalidCursor):
+            paginator.page(token[:-1] + ('A' if token[-1] != 'A' else 'B'))
+
+    def test_clear_st_deleted(self):
+        import os
+        import tempfile
+        from django.core.management import call_command
+
+        uids = []
+        for i in range(3):
+            uid = 'old_deleted_%d' % i
+            SyncGateway.save_json(uid, dict(doc_type='mock', channels=[self.channel],
+                                            st_deleted=True, updated='2000-01-01T00:00:00'))
+            uids.append(uid)
+
+        checkpoint = os.path.join(tempfile.mkdtemp(), 'checkpoint.json')
+
+        call_command('clear_st_deleted', dry_run=True, checkpoint=checkpoint)
+        self.assertEqual(len(load_objects(uids, Mock)), 3)
+
+        call_command('clear_st_deleted', batch_size=2, checkpoint=checkpoint)
+        self.assertEqual(load_objects(uids, Mock), [])
+        self.assertFalse(os.path.exists(checkpoint))
+
+        # not deleted documents are kept
+        self.assertEqual(len(load_objects([self.uid1, self.uid2], Mock)), 2)
+
     def test_create_user(self):
         res = SyncGateway.put_user("username1", "email@mail.com", "password", ["public"])
         self.assertTrue(res)
@@ -682,6 +1112,23 @@ class SyncGatewayTestCase(TestCase):
         self.assertEqual(d['name'], "email@mail.com")
         self.assertEqual(d['email'], "email@mail.com")
 
+    def test_pool_stats(self):
+        SyncGateway.all_docs([self.uid1, self.uid2])
+        stats = SyncGateway.pool_stats()
+        self.assertTrue(stats)
+        self.assertTrue(sum(x['num_requests'] for x in stats) > 0)
+        for x in stats:
+            self.assertTrue(x['num_connections'] <= x['maxsize'])
+
+    def test_session_is_reused(self):
+        self.assertIs(SyncGateway.session(), SyncGateway.session())
+
+        stats_before = {(x['host'], x['port']): x['num_connections'] for x in SyncGateway.pool_stats()}
+        for _ in range(5):
+            Mock(self.uid1)
+        stats_after = {(x['host'], x['port']): x['num_connections'] for x in SyncGateway.pool_stats()}
+        self.assertEqual(stats_before, stats_after)
+
     def test_409_exception(self):
         o = Mock(title='title', channels=['boo'])
         o.save()
@@ -773,6 +1220,78 @@ class CouchbaseModeSignals(TestCase):
         self.assertEqual(data, [(m, True), (m, True)])
         self.assertEqual(len(data), 2)
 
+    def test_bulk_save_signals(self):
+        data = []
+
+        def post_save_handler(signal, sender, instance, created, **kwargs):
+            data.append(
+                (instance, created)
+            )
+
+        cb_post_save.connect(post_save_handler, Mock)
+
+        m = Mock(channels=['foo'])
+        m.save()
+        m2 = Mock(channels=['foo'])
+        del data[:]
+
+        Mock.bulk_save([m, m2])
+
+        self.assertEqual(data, [(m, False), (m2, True)])
+
+    def test_batch_signals(self):
+        from django_cbtools.batch import cb_batch
+
+        data = []
+
+        def post_save_handler(signal, sender, instance, created, **kwargs):
+            data.append(('post_save', instance, created))
+
+        def post_delete_handler(signal, sender, instance, **kwargs):
+            data.append(('post_delete', instance))
+
+        cb_post_save.connect(post_save_handler, Mock)
+        cb_post_delete.connect(post_delete_handler, Mock)
+
+        m = Mock(channels=['foo'])
+        m.save()
+        del data[:]
+
+        with cb_batch():
+            m2 = Mock(channels=['foo'])
+            m2.save()
+            # the uid is known at once, e.g. for success urls
+            self.assertTrue(m2.uid)
+            m2.title = 'saved twice'
+            m2.save()
+            m.delete()
+            self.assertEqual(data, [])
+
+        self.assertEqual(data, [('post_save', m2, True), ('post_save', m, False), ('post_delete', m)])
+        self.assertEqual('saved twice', Mock(m2.uid).title)
+        self.assertTrue(Mock(m.uid).st_deleted)
+
+        # documents saved by the handlers are written by the batch too
+        recorded = []
+
+        def log_handler(signal, sender, instance, created, **kwargs):
+            if created:
+                log = Transaction(title=instance.uid, channels=['foo'])
+                log.save()
+                recorded.append((log, log.rev))
+
+        cb_post_save.connect(log_handler, Mock)
+        try:
+            with cb_batch():
+                m3 = Mock(channels=['foo'])
+                m3.save()
+        finally:
+            cb_post_save.disconnect(log_handler, Mock)
+
+        log, rev = recorded[0]
+        self.assertIsNone(rev)
+        self.assertEqual(m3.uid, Transaction(log.uid).title)
+
     def test_cb_pre_delete(self):
         data = []
 
@@ -833,7 +1352,645 @@ class CouchbaseModeSignals(TestCase):
         self.assertEqual(data, [(m, True), (m, True)])
         self.assertEqual(len(data), 2)
 
+@skipIf(aiohttp is None, 'aiohttp is not installed')
+class AsyncTestCase(TestCase):
+    def setUp(self):
+        SyncGateway.put_admin_user()
+        clean_buckets()
+
+    def run_async(self, coroutine):
+        import asyncio
+        from django_cbtools import aio
+
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(coroutine)
+        finally:
+            loop.run_until_complete(aio.close_session())
+            loop.close()
+
+    def test_asave_aload(self):
+        m = Mock(title="my title", b=True, num=12, channels=['boo'])
+        self.run_async(m.asave())
+        self.assertIsNotNone(m.uid)
+        self.assertIsNotNone(m.rev)
+
+        loaded = self.run_async(Mock.aload(m.uid))
+        self.assertEqual(loaded.title, "my title")
+        self.assertEqual(loaded.rev, m.rev)
+
+        self.run_async(loaded.adelete())
+        self.assertTrue(Mock(m.uid).st_deleted)
+
+    def test_aload_objects(self):
+        import asyncio
+
+        objs = [Mock(title='title %d' % i, channels=['boo']) for i in range(5)]
+        self.run_async(asyncio.gather(*[o.asave() for o in objs]))
+
+        with override_settings(SYNC_GATEWAY_ALL_DOCS_CHUNK_SIZE=2):
+            loaded = self.run_async(aload_objects([o.uid for o in objs] + ['not_existing_key'], Mock))
+
+        self.assertEqual([o.uid for o in loaded], [o.uid for o in objs])
+
+    def test_load_later(self):
+        import asyncio
+        from django_cbtools import aio
+
+        objs = [Mock(title='title %d' % i, channels=['boo']) for i in range(3)]
+        Mock.bulk_save(objs)
+        uids = [o.uid for o in objs]
+
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            futures = [aio.load_later(uid, Mock) for uid in uids + ['not_existing_key', uids[0]]]
+            self.assertIs(futures[0], futures[4])
+            loaded = loop.run_until_complete(asyncio.gather(*futures))
+            loop.run_until_complete(aio.close_session())
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
+
+        self.assertEqual(['title 0', 'title 1', 'title 2'], [x.title for x in loaded[:3]])
+        self.assertIsNone(loaded[3])
+        self.assertIs(loaded[0], loaded[4])
+
+    def test_aquery_view(self):
+        import asyncio
+        from django_cbtools import aio
+        from django_cbtools.models import query_view, aquery_view, aquery_objects
+
+        objs = [Mock(title='title %d' % i, channels=['boo' if i % 2 else 'foo']) for i in range(5)]
+        Mock.bulk_save(objs)
+
+        with override_settings(COUCHBASE_STALE=False):
+            boo, foo = self.run_async(asyncio.gather(aquery_view('by_channel', ['boo', Mock.doc_type]),
+                                                     aquery_view('by_channel', ['foo', Mock.doc_type])))
+            self.assertEqual(query_view('by_channel', ['boo', Mock.doc_type]), boo)
+            self.assertEqual(sorted(x.uid for x in objs[1::2]), sorted(boo))
+            self.assertEqual(3, len(foo))
+
+            rows = self.run_async(aio.AsyncView('by_type', key=Mock.doc_type, limit=2).rows())
+            self.assertEqual([Mock.doc_type] * 2, [x.key for x in rows])
+
+            loaded = self.run_async(aquery_objects('by_channel', ['boo', Mock.doc_type], Mock))
+            self.assertEqual(['title 1', 'title 3'], sorted(x.title for x in loaded))
+
+    def test_user_methods(self):
+        from django_cbtools.aio import AsyncSyncGateway
+
+        self.run_async(AsyncSyncGateway.put_user("username1", "email@mail.com", "password", ["public"]))
+        d = self.run_async(AsyncSyncGateway.get_user("username1"))
+        self.assertEqual(d['email'], "email@mail.com")
+
+        d = self.run_async(AsyncSyncGateway.create_session("username1"))
+        self.assertIn('session_id', d)
+
+        self.run_async(AsyncSyncGateway.delete_user("username1"))
+        with self.assertRaises(SyncGatewayException):
+            self.run_async(AsyncSyncGateway.get_user("username1"))
+
+
+class ChangesConsumerTestCase(TestCase):
+    def setUp(self):
+        import os
+        import tempfile
+        from django_cbtools.checkpoint import FileCheckpoint
+
+        SyncGateway.put_admin_user()
+        clean_buckets()
+        self.checkpoint = FileCheckpoint(os.path.join(tempfile.mkdtemp(), 'changes.json'))
+
+    def test_dispatch_by_doc_type(self):
+        from django_cbtools.changes import ChangesConsumer
+        from django_cbtools.signals import cb_changes
+
+        data = []
+
+        def changes_handler(signal, sender, doc_type, changes, **kwargs):
+            data.extend((doc_type, x['id']) for x in changes)
+
+        cb_changes.connect(changes_handler, sender=Mock.doc_type)
+        self.addCleanup(cb_changes.disconnect, changes_handler, sender=Mock.doc_type)
+
+        # skip everything happened before
+        consumer = ChangesConsumer(checkpoint=self.checkpoint, batch_size=2)
+        consumer.run(once=True)
+        del data[:]
+
+        m1 = Mock(channels=['boo'])
+        m1.save()
+        m2 = Mock(channels=['boo'])
+        m2.save()
+        money = Money(channels=['boo'])
+        money.save()
+
+        consumer.run(once=True)
+        self.assertEqual(data, [(Mock.doc_type, m1.uid), (Mock.doc_type, m2.uid)])
+        self.assertEqual(self.checkpoint.load(), consumer.since)
+
+        # restarted consumer continues from the checkpoint
+        del data[:]
+        m1.save()
+        ChangesConsumer(checkpoint=self.checkpoint).run(once=True)
+        self.assertEqual(data, [(Mock.doc_type, m1.uid)])
+
+
+def benchmark(name, func, number=2000):
+    seconds = timeit.timeit(func, number=number)
+    sys.stderr.write('\n%s: %.1f us per call ' % (name, seconds * 1000000 / number))
+    return seconds
+
+
+class IdentityMapTestCase(TestCase):
+    def setUp(self):
+        SyncGateway.put_admin_user()
+        clean_buckets()
+
+    def test_same_instance(self):
+        from django_cbtools.identity_map import identity_map
+
+        m1 = Mock(title='m1', channels=['boo'])
+        m1.save()
+        m2 = Mock(title='m2', channels=['boo'])
+        m2.save()
+
+        self.assertIsNot(Mock(m1.uid), Mock(m1.uid))
+
+        objs = load_objects([m1.uid, m1.uid, m2.uid], Mock)
+        self.assertEqual(3, len(objs))
+        self.assertIsNot(objs[0], objs[1])
+        self.assertIsNot(objs[0].channels, objs[1].channels)
+
+        with identity_map():
+            a = Mock(m1.uid)
+            self.assertIs(a, Mock(m1.uid))
+            self.assertIs(a, cbm.try_else_return_none_obj(m1.uid, Mock))
+
+            objs = load_objects([m1.uid, m2.uid, m2.uid, 'not_there'], Mock)
+            self.assertEqual(3, len(objs))
+            self.assertIs(a, objs[0])
+            self.assertIs(objs[1], objs[2])
+
+            a.title = 'changed'
+            self.assertEqual('changed', Mock(m1.uid).title)
+
+            m3 = Mock(title='m3', channels=['boo'])
+            m3.save()
+            self.assertIs(m3, Mock(m3.uid))
+
+        self.assertEqual('m1', Mock(m1.uid).title)
+
+    def test_middleware(self):
+        from django_cbtools.identity_map import IdentityMapMiddleware, get_identity_map
+
+        middleware = IdentityMapMiddleware(lambda request: get_identity_map())
+        self.assertIsNotNone(middleware(None))
+        self.assertIsNone(get_identity_map())
+
+
+class LazyLoadTestCase(TestCase):
+    def setUp(self):
+        SyncGateway.put_admin_user()
+        clean_buckets()
+
+    def test_lazy(self):
+        objs = [Mock(title='m%d' % i, num=i, channels=['boo']) for i in range(3)]
+        Mock.bulk_save(objs)
+
+        lazy = [Mock(x.uid, lazy=True) for x in objs]
+        self.assertTrue(all(x.is_lazy() for x in lazy))
+        self.assertEqual(objs[0], lazy[0])
+        self.assertTrue(lazy[0].is_lazy())
+
+        lazy[1].title2 = 'assigned'
+
+        # the first access loads all the lazy documents
+        self.assertEqual('m0', lazy[0].title)
+        self.assertFalse(any(x.is_lazy() for x in lazy))
+        self.assertEqual(['boo'], lazy[2].channels)
+        self.assertEqual(objs[2].rev, lazy[2].rev)
+        self.assertEqual(1, lazy[1].num)
+        self.assertEqual('assigned', lazy[1].title2)
+
+        m = Mock(objs[0].uid, lazy=True)
+        m.title = 'changed'
+        m.save()
+        self.assertEqual('changed', Mock(objs[0].uid).title)
+        self.assertEqual(0, Mock(objs[0].uid).num)
+
+    def test_lazy_not_found(self):
+        m = Mock('mock_not_there', lazy=True)
+        with self.assertRaises(SyncGatewayException):
+            m.title
+
+    def test_lazy_loads(self):
+        from django_cbtools.lazy import get_pending, lazy_loads
+
+        objs = [Mock(title='m%d' % i, channels=['boo']) for i in range(3)]
+        Mock.bulk_save(objs)
+        get_pending().pop()
+        outside = Mock(objs[2].uid, lazy=True)
+
+        with lazy_loads():
+            lazy = [Mock(x.uid, lazy=True) for x in objs[:2]]
+            self.assertEqual(2, len(get_pending()))
+            self.assertEqual('m0', lazy[0].title)
+            self.assertFalse(lazy[1].is_lazy())
+            # documents of the thread are not loaded in the block
+            self.assertTrue(outside.is_lazy())
+
+            left = Mock(objs[0].uid, lazy=True)
+
+        # the block forgets its documents
+        self.assertEqual(1, len(get_pending()))
+        self.assertEqual('m0', left.title)
+        self.assertEqual('m2', outside.title)
+
+        # dead documents are dropped
+        get_pending().pop()
+        for i in range(1000):
+            Mock(objs[0].uid, lazy=True)
+        self.assertLess(len(get_pending()), 200)
+
+
+class LoaderTestCase(TestCase):
+    def setUp(self):
+        SyncGateway.put_admin_user()
+        clean_buckets()
+
+    def test_load_later(self):
+        from django_cbtools.loader import batch_loads, load_later
+
+        objs = [Mock(title='title %d' % i, channels=['boo']) for i in range(3)]
+        Mock.bulk_save(objs)
+        uids = [o.uid for o in objs]
+
+        with batch_loads():
+            deferred = [load_later(uid, Mock) for uid in uids + ['not_existing_key', None]]
+            self.assertFalse(deferred[0].done())
+        self.assertTrue(all(x.done() for x in deferred))
+
+        self.assertEqual(['title 0', 'title 1', 'title 2'], [x.result().title for x in deferred[:3]])
+        self.assertIsNone(deferred[3].result())
+        self.assertIsNone(deferred[4].result())
+
+        # result() loads all the pending documents
+        deferred = [load_later(uid, Mock) for uid in uids]
+        self.assertEqual('title 1', deferred[1].result().title)
+        self.assertTrue(all(x.done() for x in deferred))
+
+    def test_batch_loads_scope(self):
+        from django_cbtools.loader import batch_loads, load_later
+
+        m = Mock(title='title', channels=['boo'])
+        m.save()
+
+        # the block doesn't load documents asked outside of it
+        stray = load_later(m.uid, Mock)
+        with batch_loads():
+            deferred = load_later(m.uid, Mock)
+        self.assertTrue(deferred.done())
+        self.assertFalse(stray.done())
+        self.assertEqual('title', stray.result().title)
+
+        # an exception of the block is not replaced by the load
+        all_docs = SyncGateway.all_docs
+
+        def failing_all_docs(*args, **kwargs):
+            raise SyncGatewayException('all_docs failed')
+
+        SyncGateway.all_docs = staticmethod(failing_all_docs)
+        try:
+            with self.assertRaises(KeyError):
+                with batch_loads():
+                    deferred = load_later(m.uid, Mock)
+                    raise KeyError(m.uid)
+        finally:
+            SyncGateway.all_docs = staticmethod(all_docs)
+        self.assertFalse(deferred.done())
+
+
+class DocumentCacheTestCase(TestCase):
+    def setUp(self):
+        SyncGateway.put_admin_user()
+        clean_buckets()
+
+    @override_settings(CBTOOLS_CACHE_DOC_TYPES=[Mock.doc_type], CBTOOLS_CACHE_SIZE=10)
+    def test_cache(self):
+        from django_cbtools.cache import get_cache
+
+        m = Mock(title='cached', channels=['boo'])
+        m.save()
+        t = Transaction(title='not cached', channels=['boo'])
+        t.save()
+        get_cache().clear()
+
+        Mock(m.uid)
+        Transaction(t.uid)
+        self.assertEqual(dict(size=1, hits=0, misses=2), SyncGateway.cache_stats())
+
+        m2 = Mock(m.uid)
+        Transaction(t.uid)
+        self.assertEqual(dict(size=1, hits=1, misses=3), SyncGateway.cache_stats())
+
+        # cached rows can't be changed through the objects
+        m2.channels.append('foo')
+        self.assertEqual(['boo'], Mock(m.uid).channels)
+
+        m2.title = 'changed'
+        m2.save()
+        self.assertEqual('changed', Mock(m.uid).title)
+
+        # an older revision doesn't replace the saved one
+        get_cache().set_many([dict(id=m.uid, value=dict(rev='1-old'), doc=dict(doc_type=Mock.doc_type))])
+        self.assertEqual('changed', Mock(m.uid).title)
+
+    def test_save_during_load(self):
+        from django_cbtools.cache import DocumentCache
+
+        cache = DocumentCache(size=2, doc_types=[Mock.doc_type])
+        row = dict(id='a', value=dict(rev='1-old'), doc=dict(doc_type=Mock.doc_type))
+
+        # saved documents which are not cached or loaded leave nothing
+        for uid in 'abc':
+            cache.invalidate(uid, '2-new')
+        self.assertEqual({}, cache.tombstones)
+
+        # the revision loaded before the save is not cached
+        self.assertEqual({}, cache.get_many(['a']))
+        cache.invalidate('a', '2-new')
+        cache.set_many([row])
+        cache.release(['a'])
+        self.assertEqual({}, cache.get_many(['a']))
+        self.assertEqual({}, cache.tombstones)
+
+        # the tombstones are gone with the load
+        cache.set_many([row])
+        cache.release(['a'])
+        self.assertEqual({}, cache.loading)
+        self.assertEqual(dict(size=1, hits=0, misses=2), cache.stats())
+        self.assertEqual('1-old', cache.get_many(['a'])['a']['value']['rev'])
+
+    @override_settings(CBTOOLS_CACHE_DOC_TYPES=[Mock.doc_type], CBTOOLS_CACHE_SIZE=0,
+                       CBTOOLS_SHARED_CACHE='cbtools',
+                       CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+                               'cbtools': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_shared_cache(self):
+        from django_cbtools.cache import get_cache, invalidate_changed
+
+        objs = [Mock(title='m%d' % i, channels=['boo']) for i in range(4)]
+        Mock.bulk_save(objs)
+        uids = [x.uid for x in objs]
+
+        load_objects(uids[:2], Mock)
+        self.assertEqual(dict(size=0, hits=0, misses=0, shared_hits=0, shared_misses=2),
+                         SyncGateway.cache_stats())
+
+        loaded = load_objects(uids, Mock)
+        self.assertEqual(['m0', 'm1', 'm2', 'm3'], [x.title for x in loaded])
+        self.assertEqual(dict(size=0, hits=0, misses=0, shared_hits=2, shared_misses=4),
+                         SyncGateway.cache_stats())
+
+        # saved documents are written through
+        loaded[0].title = 'changed'
+        loaded[0].save()
+        m = Mock(uids[0])
+        self.assertEqual('changed', m.title)
+        self.assertEqual(loaded[0].rev, m.rev)
+        self.assertEqual(3, SyncGateway.cache_stats()['shared_hits'])
+
+        # documents changed by other processes are removed by cb_changes
+        invalidate_changed(sender=Mock.doc_type, doc_type=Mock.doc_type,
+                           changes=[dict(id=uids[1], changes=[dict(rev='9-xxx')])])
+        Mock(uids[1])
+        self.assertEqual(5, SyncGateway.cache_stats()['shared_misses'])
+
+        # an old revision read by another process doesn't overwrite the saved one
+        shared = get_cache().tiers[0]
+        stale = [dict(id=uids[2], value=dict(rev='1-old'), doc=dict(doc_type=Mock.doc_type, title='stale'))]
+        loaded[2].title = 'saved'
+        loaded[2].save()
+        shared.set_many(stale)
+        self.assertEqual('saved', Mock(uids[2]).title)
+
+        # neither it's cached after the document was saved by another process
+        shared.invalidate_many([(uids[2], '3-new')])
+        shared.set_many(stale)
+        self.assertEqual({}, shared.get_many([uids[2]]))
+
+    def test_disabled(self):
+        self.assertIsNone(SyncGateway.cache_stats())
+
+
+class KVReadsTestCase(TestCase):
+    def setUp(self):
+        SyncGateway.put_admin_user()
+        clean_buckets()
+
+    def test_same_rows(self):
+        from django_cbtools import kv
+
+        objs = [Mock(title='m%d' % i, num=i, channels=['boo']) for i in range(3)]
+        Mock.bulk_save(objs)
+        SyncGateway.delete_document(objs[2].uid, objs[2].rev)
+        uids = [x.uid for x in objs] + ['missing']
+
+        http = SyncGateway.all_docs(uids)['rows']
+        direct = kv.all_docs(uids)['rows']
+
+        for row, kv_row in zip(http[:2], direct[:2]):
+            self.assertEqual(row['id'], kv_row['id'])
+            self.assertEqual(row['value']['rev'], kv_row['value']['rev'])
+            self.assertEqual(row['doc'], kv_row['doc'])
+        self.assertEqual(['not_found', 'not_found'], [x.get('error') for x in direct[2:]])
+
+        with override_settings(CBTOOLS_KV_READS=True):
+            loaded = load_objects(uids, Mock)
+        self.assertEqual(['m0', 'm1'], [x.title for x in loaded])
+        self.assertEqual([x.rev for x in objs[:2]], [x.rev for x in loaded])
+
+        # writes still go through Sync-Gateway
+        loaded[0].title = 'changed'
+        loaded[0].save()
+        self.assertEqual('changed', Mock(objs[0].uid).title)
+
+    def test_benchmark(self):
+        objs = [Mock(title='m%d' % i, channels=['boo']) for i in range(100)]
+        Mock.bulk_save(objs)
+        uids = [x.uid for x in objs]
+
+        benchmark('all_docs http (100 docs)', lambda: load_objects(uids, Mock), number=20)
+        with override_settings(CBTOOLS_KV_READS=True):
+            benchmark('all_docs kv (100 docs)', lambda: load_objects(uids, Mock), number=20)
+
+
+class ConnectionPoolTestCase(TestCase):
+    def test_pool(self):
+        import threading
+        from django_cbtools.connection import ConnectionPool, CouchbasePoolTimeout
+
+        pool = ConnectionPool(size=2, timeout=0.1, factory=object)
+        with pool.connection() as conn:
+            # a connection is used by one operation at a time
+            with pool.connection() as other:
+                self.assertIsNot(conn, other)
+        self.assertEqual(dict(size=2, connections=2, idle=2), pool.stats())
+
+        # released connections are reused, also by other threads
+        loaded = []
+
+        def run():
+            with pool.connection() as c:
+                loaded.append(c)
+
+        t = threading.Thread(target=run)
+        t.start()
+        t.join()
+        self.assertIn(loaded[0], (conn, other))
+        self.assertEqual(dict(size=2, connections=2, idle=2), pool.stats())
+
+        # the connection is released when the operation fails
+        with self.assertRaises(ValueError):
+            with pool.connection():
+                raise ValueError()
+        self.assertEqual(2, pool.stats()['idle'])
+
+        # no more than ``size`` connections
+        pool = ConnectionPool(size=1, timeout=0.1, factory=object)
+        with pool.connection():
+            with self.assertRaises(CouchbasePoolTimeout):
+                with pool.connection():
+                    pass
+
+    def test_fork(self):
+        from django_cbtools.connection import get_pool, connection
+
+        pool = get_pool()
+        self.assertIs(pool, get_pool())
+        self.assertIs(connection(), connection())
+
+        # a forked process creates its own pool
+        pool.pid = -1
+        self.assertIsNot(pool, get_pool())
+
+
+class SerializationTestCase(TestCase):
+    def get_mock(self):
+        m = Mock(title=u'my title \xe9', title2='title2', num=12, b=True, channels=['boo'])
+        m.created = timezone.now()
+        m.updated = datetime.now()
+        return m
+
+    def test_to_dict_matches_legacy(self):
+        from django_cbtools.serialization import legacy_to_dict
+
+        objs = [
+            Mock(),
+            self.get_mock(),
+            Mock(title=12, num='12', channels=['boo'], uid='uid'),
+            Transaction(title='t', amount=Decimal('12.30'), channels=['boo']),
+            Transaction(title='t', amount='12.3', channels=['boo']),
+            Stamp(stamp='not a date', channels=['boo']),
+        ]
+        for obj in objs:
+            self.assertEqual(json.dumps(obj.to_dict()), json.dumps(legacy_to_dict(obj)))
+
+        p = Payment(amount=Decimal('12.34'), uid='preset')
+        self.assertEqual(json.dumps(p.to_dict()), json.dumps(legacy_to_dict(p, nested=True)))
+
+        j = Job(title='my title', channels=['boo'])
+        j.payments = [p]
+        d = j.to_dict()
+        self.assertEqual(d['payments'], [legacy_to_dict(p, nested=True)])
+
+    def test_benchmark_to_dict(self):
+        from django_cbtools.serialization import legacy_to_dict
+
+        m = self.get_mock()
+        self.assertEqual(m.to_dict(), legacy_to_dict(m))
+
+        benchmark('legacy to_dict', lambda: legacy_to_dict(m))
+        benchmark('compiled to_dict', m.to_dict)
+
+    def test_json_backend(self):
+        from django_cbtools import serialization
+
+        with override_settings(CBTOOLS_JSON_BACKEND='json'):
+            self.assertIs(serialization.get_json_backend(), json)
+            self.assertEqual(serialization.loads(serialization.dumps({'a': [1]})), {'a': [1]})
+
+    def test_to_dict_custom_date_format(self):
+        from django_cbtools.serialization import legacy_to_dict
+
+        class DateStamp(Stamp):
+            class Meta:
+                abstract = True
+
+            def _string_from_date(self, field_name):
+                value = getattr(self, field_name)
+                return value.strftime('%Y-%m-%d %H:%M') if value else None
+
+        obj = DateStamp(stamp=datetime(2017, 1, 2, 3, 4, 5), channels=['boo'])
+        obj.created = datetime(2017, 1, 2, 3, 4, 5)
+        self.assertEqual('2017-01-02 03:04', obj.to_dict()['stamp'])
+        self.assertEqual(json.dumps(obj.to_dict()), json.dumps(legacy_to_dict(obj)))
+
+    def test_from_dict_matches_legacy(self):
+        from django_cbtools.serialization import legacy_from_dict
+
+        payloads = [
+            self.get_mock().to_dict(),
+            {'title': 'x', 'created': '2017-01-02 03:04:05.123', 'updated': None},
+            {'created': '2017-01-02T03:04:05+03:00', 'updated': '2017-01-02T03:04:05Z'},
+            {'created': 'not a date', 'updated': 12},
+        ]
+        for payload in payloads:
+            m1, m2 = Mock(), Mock()
+            m1.from_dict(payload)
+            legacy_from_dict(m2, payload)
+            self.assertEqual(m1.to_dict(), m2.to_dict())
+
+        for amount in ('12.30', 12, None, 'boo'):
+            t1, t2 = Transaction(), Transaction()
+            t1.from_dict({'amount': amount})
+            legacy_from_dict(t2, {'amount': amount})
+            self.assertEqual(t1.amount, t2.amount)
+
+    def test_benchmark_from_dict(self):
+        from django_cbtools.serialization import legacy_from_dict
+
+        payload = self.get_mock().to_dict()
+        m1, m2 = Mock(), Mock()
+        m1.from_dict(payload)
+        legacy_from_dict(m2, payload)
+        self.assertEqual(m1.to_dict(), m2.to_dict())
+
+        benchmark('legacy from_dict', lambda: legacy_from_dict(Mock(), payload))
+        benchmark('compiled from_dict', lambda: Mock().from_dict(payload))
+
+
 class HelperFunctionsTestCase(TestCase):
+    def test_iter_json_rows(self):
+        payload = {
+            'rows': [
+                {'id': 'a', 'value': {'rev': '1-a'}, 'doc': {'title': u'\xe9]},{"x"', 'list': [1, {'b': None}]}},
+                {'key': 'b', 'error': 'not_found'},
+            ],
+            'total_rows': 2,
+        }
+        raw = json.dumps(payload, indent=1, ensure_ascii=False).encode('utf-8')
+
+        for size in (1, 2, 5, len(raw)):
+            data_chunks = [raw[i:i + size] for i in range(0, len(raw), size)]
+            self.assertEqual(list(iter_json_rows(data_chunks)), payload['rows'])
+
+        self.assertEqual(list(iter_json_rows([b'{"rows":[]}'])), [])
+
+        with self.assertRaises(SyncGatewayException):
+            list(iter_json_rows([b'{"rows":[{"id": "a"}, {"id"']))
+
     def test_parse_view_name(self):
         parts = parse_view_name('name')
         self.assertEqual('django_cbtools', parts[0])
@@ -4,6 +4,8 @@ from django.http import HttpResponseRedirect, Http404
 from django.views.generic import UpdateView, CreateView, DeleteView, ListView, DetailView, FormView
 from django.core.exceptions import ImproperlyConfigured
 
+from django_cbtools.pagination import KeysetPaginator, InvalidCursor, DEFAULT_PER_PAGE
+
 logger = logging.getLogger(__name__)
 
 
@@ -68,6 +70,21 @@ class FormValidMixin(object):
 
 
 class CBListView(ListView):
+    """
+    With ``view_name`` the list is a page of the view rows (see
+    ``django_cbtools.pagination.KeysetPaginator``), ``view_params`` are
+    the view query parameters. The page is chosen by ``cursor``
+    GET parameter, ``page_obj.next_cursor`` is the cursor of the next page.
+    Without ``model`` the pages contain the view rows.
+    With ``count_view_name`` ``paginator.count`` is the total number of rows.
+    """
+    view_name = None
+    view_params = None
+    count_view_name = None
+    cursor_kwarg = 'cursor'
+
+    def get_view_params(self):
+        return dict(self.view_params or {})
 
     def get_queryset(self):
         """
@@ -77,6 +94,11 @@ class CBListView(ListView):
 
         if self.queryset is not None:
             queryset = self.queryset
+        elif self.view_name is not None:
+            queryset = KeysetPaginator(self.view_name, self.model,
+                                       per_page=self.get_paginate_by(None) or DEFAULT_PER_PAGE,
+                                       count_view_name=self.count_view_name,
+                                       **self.get_view_params())
         elif self.model is not None:
             queryset = self.model.get_list(self.request)
         else:
@@ -89,6 +111,27 @@ class CBListView(ListView):
             )
         return queryset
 
+    def get_paginate_by(self, queryset):
+        if isinstance(queryset, KeysetPaginator):
+            return queryset.per_page
+        return super(CBListView, self).get_paginate_by(queryset)
+
+    def get_context_object_name(self, object_list):
+        if isinstance(object_list, KeysetPaginator) and object_list.model is None:
+            # pages of view rows
+            return self.context_object_name
+        return super(CBListView, self).get_context_object_name(object_list)
+
+    def paginate_queryset(self, queryset, page_size):
+        if not isinstance(queryset, KeysetPaginator):
+            return super(CBListView, self).paginate_queryset(queryset, page_size)
+
+        try:
+            page = queryset.page(self.request.GET.get(self.cursor_kwarg))
+        except InvalidCursor as e:
+            raise Http404(str(e))
+        return queryset, page, page.object_list, page.has_next() or page.has_previous()
+
 
 class CBDetailView(SingleObjectMixin,
                    DetailView):
@@ -74,6 +74,7 @@ setup(
         'couchbase >= 2.0.8',
         'django-extensions >= 1.6.1',
         'django-tastypie >= 0.12.2',
+        'futures >= 3.0.5; python_version < "3"',
         'requests >= 2.9.1',
         'shortuuid >= 0.4.3',
     ],
@@ -82,10 +83,9 @@ setup(
     # dependencies). You can install these using the following syntax,
     # for example:
     # $ pip install -e .[dev,test]
-    # extras_require={
-    #     'dev': ['check-manifest'],
-    #     'test': ['coverage'],
-    # },
+    extras_require={
+        'async': ['aiohttp >= 3.3'],
+    },
 
     # If there are data files included in your packages that need to be
     # installed, specify them here.  If using Python 2.6 or less, then these